@@ -0,0 +1,140 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: local_server.py
+# Author: Ra Inta
+# Description: A local stand-in for the NUFORC web server, to test crawl
+# profiles (see settings.py) without going anywhere near the real site.
+# It serves the saved monthly index pages in a directory, along with a
+# generated directory page (ndxevent.html) linking to them, and delays each
+# response to mimic the latency of the real server. It can also answer a
+# fraction of requests with '503 Service Unavailable', to check that retries
+# and AutoThrottle behave.
+#
+# For example, serve the saved pages with 200 +/- 100 ms latency:
+# $ python local_server.py path/to/saved/pages --delay 0.2 --jitter 0.1
+# and, in another terminal, crawl them with the bulk backfill profile:
+# $ NUFORC_PROFILE=bulk_backfill scrapy crawl nuforc -a base_url=http://localhost:8000/
+# then look at crawl_report.json.
+#
+# Individual report pages (e.g. 142/S142925.html) are made up on the fly,
+# for testing the nuforc_reports spider.
+#
+# If there are no saved pages, the saved example page
+# (../ndxLocOut_example.html) is served under --copies different month names
+# instead, to make a crawl of realistic size.
+#
+###########################################
+
+import argparse
+import glob
+import os
+import random
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+example_page = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "ndxLocOut_example.html")
+
+
+def monthNames(n):
+    """n distinct monthly index page names, counting back from July 1950."""
+    months = []
+    year, month = 1950, 7
+    for i in range(n):
+        months.append("ndxe{0:04d}{1:02d}.html".format(year, month))
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    return months
+
+
+def loadPages(directory, copies):
+    """Dictionary of page name to content."""
+    pages = {}
+    if directory:
+        for filename in glob.glob(os.path.join(directory, "ndxe*.html")):
+            with open(filename, 'rb') as html_file:
+                pages[os.path.basename(filename)] = html_file.read()
+    if not pages:
+        with open(example_page, 'rb') as html_file:
+            body = html_file.read()
+        for name in monthNames(copies):
+            pages[name] = body
+    return pages
+
+
+def directoryPage(pages):
+    """A stand-in for ndxevent.html. The last link is the catch-all page,
+    which the spider skips."""
+    links = ''.join('<tr><td><a href="{0}">{0}</a></td></tr>\n'.format(name)
+                    for name in sorted(pages, reverse=True))
+    links += '<tr><td><a href="ndxe.html">Unspecified / Unknown</a></td></tr>\n'
+    return ("<html><body><table>\n" + links + "</table></body></html>").encode('ascii')
+
+
+def reportPage(name):
+    """A made-up individual report page, laid out like the real ones."""
+    body = ("<html><body><table>\n"
+            "<tr><td><font>Occurred : 7/20/1950 21:30  (Entered as : 07/20/50 21:30)<br>"
+            "Reported: 12/11/2011 9:15:02 PM 21:15<br>Posted: 12/12/2011<br>"
+            "Location: Smithport, PA<br>Shape: Disk<br>Duration:two min</font></td></tr>\n"
+            "<tr><td><font>Report {0}: this huge craft came over the hill.<br>"
+            "It was orange, then it shot away with no sound.<br><br>"
+            "((NUFORC Note: Witness elects to remain anonymous.  PD))</font></td></tr>\n"
+            "</table></body></html>").format(name)
+    return body.encode('ascii')
+
+
+def makeHandler(pages, delay, jitter, error_rate):
+    directory = directoryPage(pages)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(max(0.0, random.gauss(delay, jitter)))
+            name = self.path.rsplit('/', 1)[-1]
+            if error_rate and random.random() < error_rate:
+                self.send_error(503)
+                return
+            if name == 'ndxevent.html':
+                body = directory
+            elif name in pages:
+                body = pages[name]
+            elif name.startswith('S') and name.endswith('.html'):
+                body = reportPage(name)
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=windows-1252')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve saved NUFORC index pages with artificial delays.")
+    parser.add_argument("directory", nargs="?", help="directory holding saved ndxeYYYYMM.html pages")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--delay", type=float, default=0.2, help="mean response delay (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.05, help="standard deviation of the delay (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    parser.add_argument("--copies", type=int, default=200,
+                        help="months to serve the example page as, if there are no saved pages")
+    args = parser.parse_args()
+
+    pages = loadPages(args.directory, args.copies)
+    server = ThreadingHTTPServer(('localhost', args.port), makeHandler(pages, args.delay, args.jitter, args.error_rate))
+    print("Serving {0} monthly pages at http://localhost:{1}/".format(len(pages), args.port))
+    server.serve_forever()
+
+
+###########################################
+# End of local_server.py
+###########################################
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Define here your extensions
+#
+# See documentation in:
+# https://doc.scrapy.org/en/latest/topics/extensions.html
+
+import json
+import time
+
+import numpy as np
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+
+class CrawlReport(object):
+    """Write a report of how fast we crawled when the spider closes: the
+    per-request download latency percentiles, pages/sec and bytes/sec, along
+    with the retry and error counts from the Scrapy stats collector. This is
+    the evidence for tuning the crawl profile (see settings.py): we want to go
+    as fast as the site allows, without the error and retry counts creeping
+    up. Enabled by setting NUFORC_CRAWL_REPORT to the report filename."""
+
+    percentiles = [50, 90, 95, 99]
+
+    def __init__(self, stats, report_filename):
+        self.stats = stats
+        self.report_filename = report_filename
+        self.latencies = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        report_filename = crawler.settings.get('NUFORC_CRAWL_REPORT')
+        if not report_filename:
+            raise NotConfigured('NUFORC_CRAWL_REPORT is not set')
+        ext = cls(crawler.stats, report_filename)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.start_time = time.time()
+
+    def response_received(self, response, request, spider):
+        # Set by the downloader: seconds from sending the request to
+        # receiving the response headers
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.latencies.append(latency)
+
+    def spider_closed(self, spider, reason):
+        stats = self.stats
+        if self.latencies:
+            latency_percentiles = np.percentile(self.latencies, self.percentiles)
+            for percentile, latency in zip(self.percentiles, latency_percentiles):
+                stats.set_value('latency/p{0}'.format(percentile), round(float(latency), 4))
+            stats.set_value('latency/max', round(max(self.latencies), 4))
+        elapsed = time.time() - self.start_time
+        pages = stats.get_value('downloader/response_count', 0)
+        response_bytes = stats.get_value('downloader/response_bytes', 0)
+        report = {
+            'spider': spider.name,
+            'finish_reason': reason,
+            'elapsed_seconds': round(elapsed, 3),
+            'pages': pages,
+            'bytes': response_bytes,
+            'pages_per_second': round(pages/elapsed, 3) if elapsed else None,
+            'bytes_per_second': round(response_bytes/elapsed, 1) if elapsed else None,
+            'latency_seconds': dict((key.split('/')[1], value) for key, value in stats.get_stats().items()
+                                    if key.startswith('latency/')),
+            'requests': stats.get_value('downloader/request_count', 0),
+            'retries': stats.get_value('retry/count', 0),
+            'retries_exhausted': stats.get_value('retry/max_reached', 0),
+            'status_counts': dict((key.rsplit('/', 1)[1], value) for key, value in stats.get_stats().items()
+                                  if key.startswith('downloader/response_status_count/')),
+            'exceptions': stats.get_value('downloader/exception_count', 0),
+        }
+        with open(self.report_filename, 'w') as report_file:
+            json.dump(report, report_file, indent=1, sort_keys=True)
+        spider.logger.info("Crawl report: %d pages in %.1f s (%.2f pages/s, %.0f bytes/s), "
+                           "median latency %s s; written to %s",
+                           pages, elapsed, report['pages_per_second'] or 0,
+                           report['bytes_per_second'] or 0,
+                           report['latency_seconds'].get('p50'), self.report_filename)
+
+
+class HttpCacheStats(object):
+    """Log a one line summary of the HTTP cache hits and misses (as counted
+    by Scrapy's HTTP cache middleware) when the spider closes."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('HTTPCACHE_ENABLED'):
+            raise NotConfigured('HTTPCACHE_ENABLED is not set')
+        ext = cls(crawler.stats)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_closed(self, spider, reason):
+        hits = self.stats.get_value('httpcache/hit', 0)
+        misses = self.stats.get_value('httpcache/miss', 0)
+        # Stale pages the server confirmed (304) are served from the cache too
+        revalidated = self.stats.get_value('httpcache/revalidate', 0)
+        stored = self.stats.get_value('httpcache/store', 0)
+        lookups = hits + misses
+        spider.logger.info("HTTP cache: %d hits, %d misses (%.1f%% hit rate), %d revalidated, %d stored",
+                           hits, misses, 100.0*hits/lookups if lookups else 0.0, revalidated, stored)
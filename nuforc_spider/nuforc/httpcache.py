@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+# HTTP cache policy for the NUFORC pages, used with Scrapy's HTTP cache
+# middleware (see the HTTPCACHE_* settings in settings.py). The raw pages
+# are stored gzipped on disk, keyed by URL, so re-runs during parser
+# development, or after a crash, come from local disk instead of the network.
+#
+# See: https://doc.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
+
+import datetime
+import re
+
+from scrapy.extensions.httpcache import RFC2616Policy
+
+month_page_regex = re.compile(r'ndxe(\d{4})(\d{2})\.html$')
+
+
+class MonthAgePolicy(RFC2616Policy):
+    """Monthly index pages more than NUFORC_CACHE_IMMUTABLE_YEARS years old
+    hardly ever change, so we treat them as immutable: they are always cached
+    and a cached copy is always fresh. Everything else (the directory page and
+    the recent months, which still gain reports) follows the usual HTTP
+    caching rules, i.e. is revalidated with the server once stale."""
+
+    def __init__(self, settings):
+        super(MonthAgePolicy, self).__init__(settings)
+        self.immutable_years = settings.getint('NUFORC_CACHE_IMMUTABLE_YEARS', 2)
+
+    def isImmutable(self, request):
+        month_page = month_page_regex.search(request.url)
+        if not month_page:
+            return False
+        today = datetime.date.today()
+        year, month = int(month_page.group(1)), int(month_page.group(2))
+        months_old = (today.year - year)*12 + today.month - month
+        return months_old > 12*self.immutable_years
+
+    def should_cache_response(self, response, request):
+        if response.status == 200 and self.isImmutable(request):
+            return True
+        return super(MonthAgePolicy, self).should_cache_response(response, request)
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        if self.isImmutable(request):
+            return True
+        return super(MonthAgePolicy, self).is_cached_response_fresh(cachedresponse, request)
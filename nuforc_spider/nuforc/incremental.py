@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# Support for incremental crawls. Historical months almost never change, so
+# instead of re-downloading every monthly index page we keep a small state
+# store per page (ETag/Last-Modified headers, a hash of the content and the
+# number of rows), send conditional requests, and only replace the rows of
+# the months that actually changed in the output CSV.
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from .parsing import names
+
+
+def contentHash(body):
+    """Hash of a page body, to catch pages that changed without the server
+    telling us (or that came back in full despite the conditional request)."""
+    return hashlib.sha1(body).hexdigest()
+
+
+class MonthState(object):
+    """Per month page state, stored as a JSON dictionary keyed by page URL:
+    {url: {"etag": ..., "last_modified": ..., "sha1": ..., "rows": ...}}"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.pages = {}
+        if os.path.exists(filename):
+            with open(filename) as state_file:
+                self.pages = json.load(state_file)
+
+    def conditionalHeaders(self, url):
+        """Headers that let the server answer 304 Not Modified for a page we
+        have already seen."""
+        page = self.pages.get(url, {})
+        headers = {}
+        if page.get("etag"):
+            headers["If-None-Match"] = page["etag"]
+        if page.get("last_modified"):
+            headers["If-Modified-Since"] = page["last_modified"]
+        return headers
+
+    def isUnchanged(self, url, sha1):
+        return url in self.pages and self.pages[url].get("sha1") == sha1
+
+    def update(self, url, response, sha1, rows):
+        self.pages[url] = {
+            "etag": response.headers.get("ETag", b"").decode("latin-1"),
+            "last_modified": response.headers.get("Last-Modified", b"").decode("latin-1"),
+            "sha1": sha1,
+            "rows": rows,
+        }
+
+    def save(self):
+        """Write the state to a temporary file first, so a crash can't leave
+        a truncated state file behind."""
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as state_file:
+            json.dump(self.pages, state_file, indent=1, sort_keys=True)
+        os.replace(tmp_filename, self.filename)
+
+
+def replaceMonths(csv_filename, month_rows):
+    """Replace the rows of the given months in csv_filename.
+    month_rows is a dictionary {(year, month): rows}, with the rows in the
+    order of names. Rows of all other months are left untouched."""
+    new_df = pd.DataFrame(
+        [row for rows in month_rows.values() for row in rows], columns=names)
+    if os.path.exists(csv_filename):
+        # Read everything as strings, so untouched rows are written back verbatim
+        old_df = pd.read_csv(csv_filename, dtype=str, keep_default_na=False)
+        old_months = pd.MultiIndex.from_arrays([old_df["year"], old_df["month"]])
+        keep = ~old_months.isin(list(month_rows))
+        new_df = pd.concat([old_df[keep], new_df], ignore_index=True)
+    tmp_filename = csv_filename + ".tmp"
+    new_df.to_csv(tmp_filename, sep=",", header=True, index=False)
+    os.replace(tmp_filename, csv_filename)
@@ -9,6 +9,37 @@ import scrapy
 
 
 class NuforcItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    # One report from a monthly index page. The fields are declared in the
+    # order of the CSV columns (see nuforc.parsing.names).
+    date_time = scrapy.Field()
+    year = scrapy.Field()
+    month = scrapy.Field()
+    city = scrapy.Field()
+    state = scrapy.Field()
+    shape = scrapy.Field()
+    duration = scrapy.Field()
+    posted = scrapy.Field()
+    url = scrapy.Field()
+
+
+class NuforcMonthItem(scrapy.Item):
+    # Sent after the last report of each monthly page, so the pipelines know
+    # the month is complete and can commit it in one go.
+    url = scrapy.Field()
+    year = scrapy.Field()
+    month = scrapy.Field()
+    rows = scrapy.Field()
+
+
+class NuforcReportItem(scrapy.Item):
+    # The details of one report, from its own page (S*.html). Keyed (and
+    # joined to NuforcItem) on the url. See nuforc.parsing.detail_names.
+    url = scrapy.Field()
+    occurred = scrapy.Field()
+    reported = scrapy.Field()
+    posted = scrapy.Field()
+    location = scrapy.Field()
+    shape = scrapy.Field()
+    duration = scrapy.Field()
+    description = scrapy.Field()
+    nuforc_note = scrapy.Field()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+# A durable journal of the monthly pages whose reports have been committed to
+# the output CSV, so a crawl that dies halfway can be resumed with only the
+# missing months (scrapy crawl nuforc -a resume=1).
+#
+# Each line is a JSON record of one month page:
+# {"url": ..., "year": ..., "month": ..., "rows": ..., "csv_offset": ...}
+# where csv_offset is the size of the CSV once that month (and any before it)
+# had been written and synced to disk. Anything in the CSV past the last
+# offset is from a month that never made it into the journal, and is
+# truncated away on resume.
+
+import json
+import os
+
+
+class CrawlJournal(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = []
+        if os.path.exists(filename):
+            with open(filename, 'rb+') as journal_file:
+                good_size = 0
+                for line in journal_file:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError("Incomplete line")
+                        self.entries.append(json.loads(line))
+                    except ValueError:
+                        # A torn last line from a crash: that batch of months
+                        # never completed. Cut it off now, or the next commit
+                        # would be appended to it and be lost with it
+                        journal_file.truncate(good_size)
+                        break
+                    good_size += len(line)
+
+    def completedUrls(self):
+        return set(entry['url'] for entry in self.entries)
+
+    def csvOffset(self):
+        """Size of the CSV as of the last committed month (None if nothing
+        has been committed)."""
+        return self.entries[-1]['csv_offset'] if self.entries else None
+
+    def reset(self):
+        self.entries = []
+        open(self.filename, 'w').close()
+
+    def commit(self, months, csv_offset):
+        """Record a batch of months as committed. Call this only once their
+        rows have been synced to disk."""
+        lines = []
+        for month in months:
+            entry = dict(month, csv_offset=csv_offset)
+            self.entries.append(entry)
+            lines.append(json.dumps(entry, sort_keys=True) + '\n')
+        with open(self.filename, 'a') as journal_file:
+            journal_file.write(''.join(lines))
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
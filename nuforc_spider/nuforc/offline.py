@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+# Offline parse mode: replay a local corpus of saved NUFORC monthly index
+# pages (ndxeYYYYMM.html) through the same parsing logic as the spider,
+# without touching the network. The pages are parsed in bulk over a process
+# pool, so national_ufo_reports.csv can be re-derived in seconds after a
+# parser fix. The timings printed at the end double as a repeatable
+# throughput benchmark for the parsing hot path.
+#
+# Run from the nuforc_spider directory:
+# $ python -m nuforc.offline path/to/saved/pages -o national_ufo_reports.csv
+
+import argparse
+import csv
+import glob
+import multiprocessing
+import os
+import re
+import time
+
+from scrapy.http import HtmlResponse
+
+from .parsing import base_url, names, parseIndexPage
+
+# Browsers leave a comment like this at the top of a saved page; this is how
+# we recover the original URL of e.g. ndxLocOut_example.html:
+saved_from_regex = re.compile(br'<!-- saved from url=\(\d+\)(\S+) -->')
+index_page_regex = re.compile(r'ndxe\d{6}\.html$')
+
+
+def pageUrl(filename, body):
+    """The URL a saved page was fetched from. We need it because the year and
+    month of the reports are taken from the page name (see parsePageDates)."""
+    saved_from = saved_from_regex.search(body[:1024])
+    if saved_from:
+        return saved_from.group(1).decode('ascii')
+    return base_url + os.path.basename(filename)
+
+
+def parseSavedPage(filename):
+    """Parse one saved monthly index page. Returns the page URL and its rows
+    (the URL is None if the file isn't a monthly index page)."""
+    with open(filename, 'rb') as html_file:
+        body = html_file.read()
+    url = pageUrl(filename, body)
+    if not index_page_regex.search(url):
+        return None, []
+    response = HtmlResponse(url=url, body=body, encoding='windows-1252')
+    return url, parseIndexPage(response)
+
+
+def parseLocalCorpus(directory, csv_filename, processes=None, pattern="*.html"):
+    """Parse every saved index page in directory over a process pool and write
+    the reports to csv_filename, in the same format as the spider. Pages are
+    written in sorted page-name order, so the output is reproducible.
+    Returns the number of pages and rows written."""
+    filenames = sorted(glob.glob(os.path.join(directory, pattern)))
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(parseSavedPage, filenames, chunksize=8)
+    finally:
+        pool.close()
+        pool.join()
+    results = sorted((url, rows) for url, rows in results if url is not None)
+    n_rows = 0
+    with open(csv_filename, 'w') as csv_file:
+        writer = csv.writer(csv_file, lineterminator='\n')
+        writer.writerow(names)
+        for url, rows in results:
+            writer.writerows(rows)
+            n_rows += len(rows)
+    return len(results), n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse saved NUFORC monthly index pages without the network.")
+    parser.add_argument("directory", help="directory holding the saved ndxeYYYYMM.html pages")
+    parser.add_argument("-o", "--output", default="national_ufo_reports.csv", help="CSV file to write")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--pattern", default="*.html", help="glob for the saved pages")
+    args = parser.parse_args()
+
+    start = time.time()
+    n_pages, n_rows = parseLocalCorpus(args.directory, args.output, args.processes, args.pattern)
+    elapsed = time.time() - start
+    print("Parsed {0} pages, {1} rows in {2:.2f} s ({3:.1f} pages/s, {4:.0f} rows/s)".format(
+        n_pages, n_rows, elapsed, n_pages/elapsed, n_rows/elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+# Parsing of the NUFORC monthly index pages, shared by the spider and the
+# offline (saved page) parser, and of the individual report pages. Nothing in here touches the network or the
+# output files, so it is safe to import from worker processes.
+
+import re
+from urllib.parse import urljoin
+
+# Column order of the output. Note: this is fragile. If you alter the order in
+# parseIndexPage(), you will have to alter the following appropriately.
+names = ["date_time", "year", "month", "city", "state", "shape", "duration", "posted", "url"]
+
+base_url = "http://www.nuforc.org/webreports/"
+
+# Number of cells in each row of the monthly index tables:
+# Date / Time, City, State, Shape, Duration, Summary, Posted
+n_table_cells = 7
+
+
+def getTableRows(response):
+    """Unfortunately scrapy doesn't seem to have convenience functions to
+    handle empty table elements. To mitigate data misalignment, we walk the
+    table one row (<tr>) at a time, joining the text of every cell (so empty
+    cells become empty strings) and picking up the link to the report summary
+    in the same pass. Short rows are padded out to the full width.
+    This touches each row once, rather than sweeping the whole document once
+    per column."""
+    rows = []
+    for row in response.xpath('//table//tr[td]'):
+        tr = row.root
+        cells = [''.join(td.itertext()) for td in tr.iterchildren('td')]
+        cells += [''] * (n_table_cells - len(cells))
+        links = tr.xpath('td//a/@href')
+        rows.append((cells, links[0] if links else ''))
+    return rows
+
+
+def parsePageDates(link):
+    """The date_time field in the HTML tables are of the form dd/mm/yy; this does not
+    capture the actual year properly (especially for dates across centuries). However, the
+    full year (i.e. yyyy), along with the month (mm) _is_ encapsulated in the name of the
+    HTML page containing the data. We take this as a string and slice it accordingly."""
+    relative_link = link.split("/")[-1]
+    year = relative_link[4:8]
+    month = relative_link[8:10]
+    return year, month
+
+
+def parseIndexPage(response):
+    """Return the reports on a monthly index page as a list of rows, in the
+    order of names. The links on the live site are relative to base_url;
+    pages saved from a browser have them rewritten as absolute URLs, which
+    urljoin leaves alone."""
+    year, month = parsePageDates(response.url)
+    return [[cells[0], year, month, cells[1], cells[2], cells[3], cells[4],
+             cells[6], urljoin(base_url, link)] for cells, link in getTableRows(response)]
+
+
+# Fields in the header cell of an individual report page (S*.html), e.g.
+# Occurred : 8/30/2018 22:00  (Entered as : 08/30/18 22:00)
+# Reported: 8/30/2018 10:41:38 PM 22:41
+# Posted: 8/31/2018
+# Location: Morehead City, NC
+# Shape: Unknown
+# Duration:1 hour
+report_fields = ["occurred", "reported", "posted", "location", "shape", "duration"]
+detail_names = ["url"] + report_fields + ["description", "nuforc_note"]
+
+entered_as_regex = re.compile(r'\(Entered as.*?\)')
+nuforc_note_regex = re.compile(r'\(\(\s*NUFORC Note:?(.*?)\)\)', re.S)
+whitespace_regex = re.compile(r'\s+')
+
+
+def cleanText(text):
+    """Collapse runs of whitespace (including newlines) to single spaces, so
+    each report fits on one line of the output."""
+    return whitespace_regex.sub(' ', text).strip()
+
+
+def parseReportPage(response):
+    """Return the fields of an individual report page as a dictionary, keyed
+    by detail_names. The first cell of the table holds the 'Key: value' fields
+    (one per line); the rest hold the free-text description, which often ends
+    with a note from NUFORC in double parentheses. We split that note out."""
+    report = dict((name, '') for name in detail_names)
+    report["url"] = response.url
+    cells = response.xpath('//table//tr/td')
+    if not cells:
+        return report
+    for line in cells[0].root.itertext():
+        key, sep, value = line.partition(':')
+        key = key.strip().lower()
+        if sep and key in report_fields and not report[key]:
+            report[key] = cleanText(entered_as_regex.sub('', value))
+    description = cleanText(' '.join(' '.join(cell.root.itertext()) for cell in cells[1:]))
+    notes = nuforc_note_regex.findall(description)
+    report["nuforc_note"] = ' '.join(cleanText(note) for note in notes)
+    report["description"] = cleanText(nuforc_note_regex.sub('', description))
+    return report
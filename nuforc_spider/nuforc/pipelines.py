@@ -5,7 +5,293 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
+import csv
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scrapy.exceptions import NotConfigured
+
+from .incremental import replaceMonths
+from .items import NuforcMonthItem
+from .journal import CrawlJournal
+from .parsing import detail_names, names
+
+# The columnar output is optional: it needs the pyarrow library
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
 
 class NuforcPipeline(object):
+    """Stream the scraped reports into the output CSV. The file is opened (and
+    the header written) once, when the spider opens, and written through a
+    single buffered writer.
+
+    The rows of each monthly page are held until the page's NuforcMonthItem
+    arrives, then written in one go. Once at least NUFORC_CSV_FLUSH_ROWS rows
+    have been written, the CSV is synced to disk and the completed months are
+    recorded in the crawl journal (NUFORC_JOURNAL_FILE), so a crashed crawl
+    can be resumed with -a resume=1: the CSV is cut back to the last
+    committed month and only the missing months are crawled.
+
+    In an incremental crawl the months that changed instead replace their
+    old rows in the CSV when the spider closes, and only then is the
+    spider's MonthState saved."""
+
+    def __init__(self, csv_filename, flush_rows, journal_filename):
+        self.csv_filename = csv_filename
+        self.flush_rows = flush_rows
+        self.journal_filename = journal_filename
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            csv_filename=crawler.settings.get('NUFORC_CSV_FILE', 'national_ufo_reports.csv'),
+            flush_rows=crawler.settings.getint('NUFORC_CSV_FLUSH_ROWS', 1000),
+            journal_filename=crawler.settings.get('NUFORC_JOURNAL_FILE', 'nuforc_journal.jsonl'),
+        )
+
+    def open_spider(self, spider):
+        self.incremental = getattr(spider, 'incremental', False)
+        self.month_rows = {}
+        if self.incremental:
+            self.changed_months = {}
+            return
+        self.pending_months = []
+        self.n_pending_rows = 0
+        self.journal = CrawlJournal(self.journal_filename)
+        if getattr(spider, 'resume', False) and self.journal.csvOffset() is not None:
+            # Throw away anything written after the last committed month
+            self.csv_file = open(self.csv_filename, 'r+', newline='', encoding='utf-8')
+            self.csv_file.truncate(self.journal.csvOffset())
+            self.csv_file.seek(0, os.SEEK_END)
+            self.writer = csv.writer(self.csv_file, lineterminator='\n')
+        else:
+            self.journal.reset()
+            self.csv_file = open(self.csv_filename, 'w', newline='', encoding='utf-8')
+            self.writer = csv.writer(self.csv_file, lineterminator='\n')
+            self.writer.writerow(names)
+
+    def process_item(self, item, spider):
+        if isinstance(item, NuforcMonthItem):
+            self.commitMonth(item)
+            return item
+        row = [item.get(name, '') for name in names]
+        self.month_rows.setdefault((row[1], row[2]), []).append(row)
+        return item
+
+    def commitMonth(self, item):
+        rows = self.month_rows.pop((item['year'], item['month']), [])
+        if self.incremental:
+            # A changed month may have lost all of its rows, which is why we
+            # go by the month items rather than the rows we received
+            self.changed_months[(item['year'], item['month'])] = rows
+            return
+        self.writer.writerows(rows)
+        self.pending_months.append(dict(item))
+        self.n_pending_rows += len(rows)
+        if self.n_pending_rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        """Sync the CSV to disk, then journal the months written since the
+        last flush. In that order, the journal never claims a month that
+        isn't safely in the CSV."""
+        if not self.pending_months:
+            return
+        self.csv_file.flush()
+        os.fsync(self.csv_file.fileno())
+        self.journal.commit(self.pending_months, self.csv_file.tell())
+        self.pending_months = []
+        self.n_pending_rows = 0
+
+    def close_spider(self, spider):
+        if self.incremental:
+            if self.changed_months:
+                replaceMonths(self.csv_filename, self.changed_months)
+                # Only once the CSV has their rows, so that if replacing them
+                # fails, the next run fetches the changed months again
+                spider.month_state.save()
+                spider.logger.info("Replaced the rows of %d changed months", len(self.changed_months))
+            return
+        self.flush()
+        self.csv_file.close()
+
+
+class NuforcReportPipeline(object):
+    """Append the details of each report (see the nuforc_reports spider) to
+    NUFORC_REPORTS_FILE as soon as it arrives, flushing every
+    NUFORC_CSV_FLUSH_ROWS rows, and log progress with an ETA every
+    NUFORC_PROGRESS_ROWS rows."""
+
+    def __init__(self, details_filename, flush_rows, progress_rows):
+        self.details_filename = details_filename
+        self.flush_rows = flush_rows
+        self.progress_rows = progress_rows
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            details_filename=crawler.settings.get('NUFORC_REPORTS_FILE', 'national_ufo_report_details.csv'),
+            flush_rows=crawler.settings.getint('NUFORC_CSV_FLUSH_ROWS', 1000),
+            progress_rows=crawler.settings.getint('NUFORC_PROGRESS_ROWS', 1000),
+        )
+
+    def open_spider(self, spider):
+        new_file = not os.path.exists(self.details_filename)
+        if not new_file:
+            self.dropTornLine()
+        self.csv_file = open(self.details_filename, 'a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.csv_file, lineterminator='\n')
+        if new_file:
+            self.writer.writerow(detail_names)
+        self.n_written = 0
+        self.start_time = time.time()
+
+    def dropTornLine(self):
+        """Cut off a last line left incomplete by a crash (every report is on
+        a line of its own)."""
+        with open(self.details_filename, 'rb+') as csv_file:
+            csv_file.seek(0, os.SEEK_END)
+            size = csv_file.tell()
+            if size == 0:
+                return
+            csv_file.seek(size - 1)
+            if csv_file.read(1) == b'\n':
+                return
+            # Walk back to the end of the last complete line
+            block = 1 << 16
+            end = size
+            while end > 0:
+                start = max(0, end - block)
+                csv_file.seek(start)
+                newline = csv_file.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    csv_file.truncate(start + newline + 1)
+                    return
+                end = start
+            csv_file.truncate(0)
+
     def process_item(self, item, spider):
+        self.writer.writerow([item.get(name, '') for name in detail_names])
+        self.n_written += 1
+        if self.n_written % self.flush_rows == 0:
+            self.csv_file.flush()
+        if self.n_written % self.progress_rows == 0:
+            self.logProgress(spider)
         return item
+
+    def logProgress(self, spider):
+        elapsed = time.time() - self.start_time
+        rate = self.n_written/elapsed if elapsed else 0.0
+        n_todo = max(getattr(spider, 'n_todo', 0), self.n_written)
+        eta = (n_todo - self.n_written)/rate if rate else 0.0
+        spider.logger.info("Reports: %d/%d (%.1f%%), %.1f pages/s, ETA %s",
+                           self.n_written, n_todo, 100.0*self.n_written/n_todo if n_todo else 100.0, rate,
+                           time.strftime('%H:%M:%S', time.gmtime(max(eta, 0.0))))
+
+    def close_spider(self, spider):
+        self.csv_file.close()
+        self.logProgress(spider)
+
+
+def eventTimes(df):
+    """The event time of each report, as datetime64[s] (which, unlike pandas'
+    default nanoseconds, reaches back before 1678). The date_time field only
+    has a two-digit year, so the year and month are taken from the page URL
+    (the year and month columns) and only the day and time from date_time.
+    Anything that doesn't look like m/d/yy [hh:mm], or isn't a real date,
+    becomes NaT. This must give the same times as eventTimes in ufo_data.py,
+    which builds them from the CSV."""
+    parts = df['date_time'].str.extract(r'^\s*\d{1,2}/(\d{1,2})/\d{2,4}(?:\s+(\d{1,2}):(\d{2}))?')
+    parts = parts.apply(pd.to_numeric)
+    day, hour, minute = parts[0], parts[1].fillna(0), parts[2].fillna(0)
+    months = (df['year'].astype(np.int64) - 1970)*12 + df['month'].astype(np.int64) - 1
+    seconds = (day - 1)*86400 + hour*3600 + minute*60
+    valid = day.between(1, 31) & hour.between(0, 24) & minute.between(0, 59)
+    month_start = months.values.astype('datetime64[M]')
+    times = month_start.astype('datetime64[s]') + np.where(valid, seconds, 0).astype('timedelta64[s]')
+    # A day beyond the end of the month (e.g. 2/30) would spill over into the next
+    valid = valid.values & (times.astype('datetime64[M]') == month_start)
+    times[~valid] = np.datetime64('NaT')
+    return times
+
+
+class NuforcParquetPipeline(object):
+    """Also write the reports as a typed, columnar (Parquet) dataset,
+    partitioned by year and month:
+
+        NUFORC_PARQUET_DIR/year=YYYY/month=M/part-0.parquet
+
+    Shape and state are stored as dictionary (categorical) columns, and the
+    event time as a proper timestamp, so the analysis needn't re-parse and
+    re-type the CSV every time. Year and month live in the partition paths.
+
+    Rows are grouped by month as they arrive and each month's partition is
+    written (replacing any previous one) as soon as its NuforcMonthItem
+    arrives, so an incremental crawl only rewrites the months that changed,
+    and a crashed crawl keeps the months it finished."""
+
+    def __init__(self, dataset_dir):
+        self.dataset_dir = dataset_dir
+        # Explicit, so every partition has the same schema (even a month
+        # where e.g. no report has a shape)
+        self.schema = pa.schema([
+            ('date_time', pa.string()),
+            ('city', pa.string()),
+            ('state', pa.dictionary(pa.int16(), pa.string())),
+            ('shape', pa.dictionary(pa.int16(), pa.string())),
+            ('duration', pa.string()),
+            ('posted', pa.string()),
+            ('url', pa.string()),
+            ('event_time', pa.timestamp('s')),
+        ])
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        dataset_dir = crawler.settings.get('NUFORC_PARQUET_DIR')
+        if not dataset_dir:
+            raise NotConfigured('NUFORC_PARQUET_DIR is not set')
+        if pa is None:
+            raise NotConfigured('pyarrow is not installed')
+        return cls(dataset_dir)
+
+    def open_spider(self, spider):
+        self.month_rows = {}
+
+    def process_item(self, item, spider):
+        if isinstance(item, NuforcMonthItem):
+            self.writeMonth(item['year'], item['month'],
+                            self.month_rows.pop((item['year'], item['month']), []))
+            return item
+        row = [item.get(name, '') for name in names]
+        self.month_rows.setdefault((row[1], row[2]), []).append(row)
+        return item
+
+    def writeMonth(self, year, month, rows):
+        partition_dir = os.path.join(
+            self.dataset_dir, 'year={0}'.format(int(year)), 'month={0}'.format(int(month)))
+        partition_filename = os.path.join(partition_dir, 'part-0.parquet')
+        if not rows:
+            # A month that lost all of its reports
+            if os.path.exists(partition_filename):
+                os.remove(partition_filename)
+            return
+        month_df = pd.DataFrame(rows, columns=names)
+        # Empty cells are missing values, as they are when reading the CSV
+        month_df = month_df.replace('', None)
+        month_df['event_time'] = eventTimes(month_df)
+        month_df['state'] = month_df['state'].astype('category')
+        month_df['shape'] = month_df['shape'].astype('category')
+        month_df = month_df.drop(columns=['year', 'month'])
+        os.makedirs(partition_dir, exist_ok=True)
+        table = pa.Table.from_pandas(month_df, schema=self.schema, preserve_index=False)
+        # Write to a temporary file first, so a crash can't leave a
+        # half-written partition behind (readers skip files starting with '.')
+        tmp_filename = os.path.join(partition_dir, '.part-0.parquet.tmp')
+        pq.write_table(table, tmp_filename)
+        os.replace(tmp_filename, partition_filename)
@@ -9,6 +9,8 @@
 #     https://doc.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://doc.scrapy.org/en/latest/topics/spider-middleware.html
 
+import os
+
 BOT_NAME = 'nuforc'
 
 SPIDER_MODULES = ['nuforc.spiders']
@@ -58,15 +60,40 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable extensions
 # See https://doc.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+EXTENSIONS = {
+    'nuforc.extensions.CrawlReport': 500,
+    'nuforc.extensions.HttpCacheStats': 510,
+}
+
+# Where CrawlReport writes the latency percentiles, pages/sec and bytes/sec
+# of each run. Set this to '' to skip it.
+NUFORC_CRAWL_REPORT = 'crawl_report.json'
 
 # Configure item pipelines
 # See https://doc.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    'nuforc.pipelines.NuforcPipeline': 300,
-#}
+ITEM_PIPELINES = {
+    'nuforc.pipelines.NuforcPipeline': 300,
+    'nuforc.pipelines.NuforcParquetPipeline': 400,
+}
+
+# Where NuforcPipeline writes the reports, and how many rows it writes
+# (in whole months) between syncing the CSV to disk
+NUFORC_CSV_FILE = 'national_ufo_reports.csv'
+NUFORC_CSV_FLUSH_ROWS = 1000
+
+# Where the nuforc_reports spider writes the details of each report (keyed on
+# the url), and how often it logs its progress
+NUFORC_REPORTS_FILE = 'national_ufo_report_details.csv'
+NUFORC_PROGRESS_ROWS = 1000
+
+# Journal of the months committed to the CSV, for resuming a crawl that died
+# part way through (scrapy crawl nuforc -a resume=1)
+NUFORC_JOURNAL_FILE = 'nuforc_journal.jsonl'
+
+# Directory for the typed, columnar copy of the reports (partitioned by year
+# and month), written by NuforcParquetPipeline if pyarrow is installed.
+# Set this to '' to skip it.
+NUFORC_PARQUET_DIR = 'national_ufo_reports'
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://doc.scrapy.org/en/latest/topics/autothrottle.html
@@ -83,8 +110,70 @@ ROBOTSTXT_OBEY = True
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://doc.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-#HTTPCACHE_ENABLED = True
-#HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = 'httpcache'
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+# The raw pages are kept gzipped on disk (under .scrapy/httpcache), keyed by URL.
+# Pages never expire from the store itself; freshness is decided by
+# MonthAgePolicy, which treats months more than NUFORC_CACHE_IMMUTABLE_YEARS
+# years old as immutable and revalidates everything else with the server.
+# Old months do still pick up the odd late report, which a cached copy will
+# never show, so the cache is off unless asked for (NUFORC_PROFILE=dev_cache,
+# for re-running the spider while working on the parser). To pick up the late
+# reports with the cache on, crawl once with
+# -s NUFORC_CACHE_IMMUTABLE_YEARS=1000 (every month is revalidated with the
+# server, and the cache updated), or delete .scrapy/httpcache.
+HTTPCACHE_ENABLED = False
+HTTPCACHE_EXPIRATION_SECS = 0
+HTTPCACHE_DIR = 'httpcache'
+HTTPCACHE_IGNORE_HTTP_CODES = [408, 429, 500, 502, 503, 504]
+HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+HTTPCACHE_GZIP = True
+HTTPCACHE_POLICY = 'nuforc.httpcache.MonthAgePolicy'
+NUFORC_CACHE_IMMUTABLE_YEARS = 2
+
+
+# Crawl profiles
+# A named set of settings overriding the defaults above, chosen with the
+# NUFORC_PROFILE environment variable, e.g.:
+# $ NUFORC_PROFILE=bulk_backfill scrapy crawl nuforc
+# Check crawl_report.json afterwards: if the retry count or the 429/503
+# responses climb, back off AUTOTHROTTLE_TARGET_CONCURRENCY.
+PROFILES = {
+    # Re-running the spider while working on the parser: the pages come from
+    # the HTTP cache on disk rather than the network (see above)
+    'dev_cache': {
+        'HTTPCACHE_ENABLED': True,
+    },
+    # A full backfill of every month: as fast as the site allows. AutoThrottle
+    # adapts the delay to the observed latency, aiming for a few requests in
+    # flight at once, while the per-domain cap stops a burst from hammering it.
+    'bulk_backfill': {
+        'CONCURRENT_REQUESTS': 32,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 8,
+        'DOWNLOAD_DELAY': 0.25,
+        'DOWNLOAD_TIMEOUT': 60,
+        'AUTOTHROTTLE_ENABLED': True,
+        'AUTOTHROTTLE_START_DELAY': 1.0,
+        'AUTOTHROTTLE_MAX_DELAY': 30.0,
+        'AUTOTHROTTLE_TARGET_CONCURRENCY': 4.0,
+        # Resolve www.nuforc.org once, not for every request
+        'DNSCACHE_ENABLED': True,
+        'DNSCACHE_SIZE': 1000,
+        'DNS_TIMEOUT': 30,
+        # Ask for gzip; the index pages compress very well
+        'COMPRESSION_ENABLED': True,
+        # Retry transient failures (including 'slow down' responses), but
+        # give up on a page rather than retrying forever
+        'RETRY_ENABLED': True,
+        'RETRY_TIMES': 5,
+        'RETRY_HTTP_CODES': [500, 502, 503, 504, 522, 524, 408, 429],
+        'COOKIES_ENABLED': False,
+        'TELNETCONSOLE_ENABLED': False,
+        'LOG_LEVEL': 'INFO',
+    },
+}
+
+profile = os.environ.get('NUFORC_PROFILE')
+if profile:
+    if profile not in PROFILES:
+        raise ValueError("Unknown NUFORC_PROFILE '{0}': choose one of {1}".format(
+            profile, ', '.join(sorted(PROFILES))))
+    globals().update(PROFILES[profile])
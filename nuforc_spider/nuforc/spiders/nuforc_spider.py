@@ -9,9 +9,9 @@
 # Note we could have exported the result as a CSV directly, using the
 # scrapy crawl nuforc -o nuforc_raw.csv
 # syntax. However, we wish to enforce data alignment in the face of
-# missing data elements in the HTML tables. So we instead leverage
-# the built-in checks provided by pandas DataFrame and append the result
-# to the CSV.
+# missing data elements in the HTML tables. So we instead parse each table
+# row into a NuforcItem with a fixed set of fields, and stream the items
+# into the CSV through NuforcPipeline (see pipelines.py).
 #
 # Created: August 30, 2018
 # Last Modified: September 12, 2018
@@ -19,73 +19,106 @@
 ###########################################
 
 import scrapy
-import pandas as pd
-import numpy as np
-from lxml import html
-import requests
 
-# Prepare the header for the CSV file
-# Note: this is fragile. If you alter the filename or name order in the parsing
-# definition, you will have to alter the following appropriately.
-names = ["date_time", "year", "month", "city", "state", "shape", "duration", "posted", "url"]
-csv_filename = "national_ufo_reports.csv"
-with open(csv_filename, 'w') as csv_file:
-     csv_file.write(','.join(names) + '\n')
-
-def getTableElement(n, response):
-    """Unfortunately scrapy doesn't seem to have convenience functions to
-    handle empty table elements. To mitigate data misalignment, we explicitly
-    join an empty string to the response result."""
-    x_string = '//table//td[' + str(n) + ']'
-    return [''.join(x.xpath('.//text()').extract()) for x in response.xpath(x_string)]
-
-def parsePageDates(link):
-    """The date_time field in the HTML tables are of the form dd/mm/yy; this does not
-    capture the actual year properly (especially for dates across centuries). However, the
-    full year (i.e. yyyy), along with the month (mm) _is_ encapsulated in the name of the
-    HTML page containing the data. We take this as a string and slice it accordingly."""
-    relative_link = link.split("/")[-1]
-    year = relative_link[4:8]
-    month = relative_link[8:10]
-    return year, month
+from ..incremental import MonthState, contentHash
+from ..items import NuforcItem, NuforcMonthItem
+from ..journal import CrawlJournal
+from ..parsing import names, parseIndexPage, parsePageDates
 
 class UFOSpider(scrapy.Spider):
     name = "nuforc"
     # The following URLs are from the main NUFORC pages:
     base_url = "http://www.nuforc.org/webreports/"
     link_directory = base_url + 'ndxevent.html'
-    # Get the list of links from the directory page
-    # This is because there is no 'next' link on the data pages, so we can't
-    # follow them.
-    print("Base URL: " + base_url)
-    link_page = requests.get(link_directory)
-    link_tree = html.fromstring(link_page.content)
-    linx = link_tree.xpath('//table//td//a//@href')
-    linx = ["http://www.nuforc.org/webreports/" + x for x in linx]
-    # Get rid of the very last item in the link list because it's a dumping
-    # ground for highly uncertain reports:
-    linx.pop()
-    start_urls = linx
+
+    def __init__(self, incremental=False, state_file="nuforc_state.json", base_url=None,
+                 resume=False, *args, **kwargs):
+        """Pass -a incremental=1 to only re-fetch monthly pages that changed
+        since the last run (as recorded in state_file), and to replace only
+        those months' rows in the CSV.
+        Pass -a resume=1 to carry on from a crawl that died part way through,
+        crawling only the months missing from the crawl journal.
+        Pass -a base_url=... to crawl a mirror of the pages instead (such as
+        the local test server in local_server.py)."""
+        super(UFOSpider, self).__init__(*args, **kwargs)
+        if base_url:
+            self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+            self.link_directory = self.base_url + 'ndxevent.html'
+        self.incremental = str(incremental).lower() in ("1", "true", "yes")
+        self.resume = str(resume).lower() in ("1", "true", "yes") and not self.incremental
+        if self.incremental:
+            self.month_state = MonthState(state_file)
+            self.changed_months = set()
+
+    def start_requests(self):
+        # There is no 'next' link on the data pages, so we can't follow them.
+        # Instead, the directory page is the one start request, and the month
+        # pages are scheduled from it as it is parsed.
+        self.logger.info("Base URL: %s", self.base_url)
+        yield scrapy.Request(self.link_directory, callback=self.parseDirectory, dont_filter=True)
+
+    async def start(self):
+        # Scrapy >= 2.13 asks start() for the start requests; older versions
+        # call start_requests() directly.
+        for request in self.start_requests():
+            yield request
+
+    def parseDirectory(self, response):
+        """Get the list of links from the directory page and request each
+        monthly page in turn."""
+        linx = response.xpath('//table//td//a/@href').getall()
+        completed = set()
+        if self.resume:
+            completed = CrawlJournal(self.settings.get('NUFORC_JOURNAL_FILE', 'nuforc_journal.jsonl')).completedUrls()
+            self.logger.info("Resuming: %d months already completed", len(completed))
+        # Get rid of the very last item in the link list because it's a dumping
+        # ground for highly uncertain reports:
+        for link in linx[:-1]:
+            url = response.urljoin(link)
+            if url in completed:
+                self.crawler.stats.inc_value('resume/skipped')
+                continue
+            if self.incremental:
+                # Let 304 Not Modified through to parse(), rather than
+                # having it filtered out as an error
+                yield scrapy.Request(url, headers=self.month_state.conditionalHeaders(url),
+                                     meta={'handle_httpstatus_list': [304]})
+            else:
+                yield scrapy.Request(url)
 
     def parse(self, response):
-        # Get proper year and month from current URL
+        if self.incremental:
+            rows = self.parseIncremental(response)
+            if rows is None:
+                # Unchanged since the last run
+                return
+        else:
+            rows = parseIndexPage(response)
+        # One item per report, with the year + month taken from the URL...
+        for row in rows:
+            yield NuforcItem(zip(names, row))
+        # ...then mark the month as complete
         year, month = parsePageDates(response.url)
-        # Create the DataFrame for the current year + month
-        scraped_df = pd.DataFrame()
-        scraped_df["date_time"] = getTableElement(1, response)
-        scraped_df["year"] = year
-        scraped_df["month"] = month
-        scraped_df["city"] = getTableElement(2, response)
-        scraped_df["state"] = getTableElement(3, response)
-        scraped_df["shape"] = getTableElement(4, response)
-        scraped_df["duration"] = getTableElement(5, response)
-        scraped_df["posted"] = getTableElement(7, response)
-        # Get all the links to the summaries in one pass:
-        base_url = "http://www.nuforc.org/webreports/"
-        scraped_df["url"] = \
-            [ base_url + x for x in response.xpath('//table//td//a//@href').extract()]
-        # Append DataFrame to the CSV
-        scraped_df.to_csv("national_ufo_reports.csv", mode="a", sep=",", header=False, index=False)
+        yield NuforcMonthItem(url=response.url, year=year, month=month, rows=len(rows))
+
+    def parseIncremental(self, response):
+        """The rows of a month page if it changed since the last run (None if
+        it didn't). They replace that month's rows in the CSV when the spider
+        closes, and NuforcPipeline then saves month_state, so the state never
+        claims months the CSV doesn't have."""
+        stats = self.crawler.stats
+        if response.status == 304:
+            stats.inc_value('incremental/not_modified')
+            return None
+        sha1 = contentHash(response.body)
+        if self.month_state.isUnchanged(response.url, sha1):
+            stats.inc_value('incremental/unchanged')
+            return None
+        rows = parseIndexPage(response)
+        self.changed_months.add(parsePageDates(response.url))
+        self.month_state.update(response.url, response, sha1, len(rows))
+        stats.inc_value('incremental/changed')
+        return rows
 
 
 
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: report_spider.py
+# Author: Ra Inta
+# Description: The second stage of the crawl. The monthly index pages only
+# carry a short summary of each report; the full narrative lives on the
+# report's own page (e.g. webreports/142/S142925.html). This spider follows
+# the url of every report in national_ufo_reports.csv (as harvested by the
+# nuforc spider), and writes the details of each report (the free-text
+# description, plus the occurred/reported/posted times, location, shape and
+# duration) to a separate CSV, keyed on the url:
+#
+# $ scrapy crawl nuforc_reports
+#
+# There are over 100,000 of these pages, so:
+# - requests are generated lazily from the CSV, and each report is written
+#   out as soon as it is parsed; nothing is held in memory;
+# - concurrency per host is kept low, and AutoThrottle backs off further if
+#   the server slows down;
+# - reports already in the output are skipped, so an interrupted crawl can be
+#   simply restarted;
+# - progress (and an ETA) is logged as we go (see NuforcReportPipeline).
+#
+###########################################
+
+import csv
+import os
+from urllib.parse import urljoin
+
+import scrapy
+
+from ..items import NuforcReportItem
+from .. import parsing
+from ..parsing import parseReportPage
+
+
+class ReportSpider(scrapy.Spider):
+    name = "nuforc_reports"
+    custom_settings = {
+        # Only the report pipeline: the others would overwrite the reports CSV
+        'ITEM_PIPELINES': {
+            'nuforc.pipelines.NuforcReportPipeline': 300,
+        },
+        'CONCURRENT_REQUESTS': 16,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 4,
+        'DOWNLOAD_DELAY': 0.25,
+        'AUTOTHROTTLE_ENABLED': True,
+        'AUTOTHROTTLE_TARGET_CONCURRENCY': 2.0,
+        'NUFORC_CRAWL_REPORT': 'crawl_report_reports.json',
+        # Each report page is only fetched once, so caching them would only
+        # fill the disk with another copy of every report
+        'HTTPCACHE_ENABLED': False,
+    }
+
+    def __init__(self, limit=None, base_url=None, *args, **kwargs):
+        """Pass -a limit=N to fetch at most N (new) reports.
+        Pass -a base_url=... to fetch the pages from a mirror instead (such as
+        the local test server in local_server.py); they are still keyed on
+        their original urls."""
+        super(ReportSpider, self).__init__(*args, **kwargs)
+        self.limit = int(limit) if limit else None
+        self.base_url = base_url
+
+    def start_requests(self):
+        reports_filename = self.settings.get('NUFORC_CSV_FILE', 'national_ufo_reports.csv')
+        details_filename = self.settings.get('NUFORC_REPORTS_FILE', 'national_ufo_report_details.csv')
+        done = self.completedUrls(details_filename)
+        # One pass to count what's left (for the progress report), and another
+        # to generate the requests as the scheduler asks for them
+        self.n_todo = sum(1 for url in self.reportUrls(reports_filename) if url not in done)
+        if self.limit is not None:
+            self.n_todo = min(self.n_todo, self.limit)
+        self.logger.info("%d reports already fetched, %d to go", len(done), self.n_todo)
+        n_requested = 0
+        for url in self.reportUrls(reports_filename):
+            if url in done:
+                continue
+            if self.limit is not None and n_requested >= self.limit:
+                break
+            n_requested += 1
+            request_url = url
+            if self.base_url:
+                request_url = urljoin(self.base_url, url.split(parsing.base_url, 1)[-1])
+            yield scrapy.Request(request_url, callback=self.parse, meta={'report_url': url})
+
+    async def start(self):
+        # Scrapy >= 2.13 asks start() for the start requests; older versions
+        # call start_requests() directly.
+        for request in self.start_requests():
+            yield request
+
+    def reportUrls(self, reports_filename):
+        """The distinct report urls in the reports CSV, in file order."""
+        seen = set()
+        with open(reports_filename, newline='', encoding='utf-8') as csv_file:
+            for row in csv.DictReader(csv_file):
+                url = row['url']
+                if url and url not in seen:
+                    seen.add(url)
+                    yield url
+
+    def completedUrls(self, details_filename):
+        """The urls of the reports already written to the details CSV. Each
+        report is on a line of its own, so a last line without a newline was
+        cut short by a crash, and doesn't count."""
+        if not os.path.exists(details_filename):
+            return set()
+        with open(details_filename, newline='', encoding='utf-8') as csv_file:
+            complete_lines = (line for line in csv_file if line.endswith('\n'))
+            return set(row['url'] for row in csv.DictReader(complete_lines))
+
+    def parse(self, response):
+        report = parseReportPage(response)
+        # Key on the url as listed in the reports CSV, even if we were redirected
+        report['url'] = response.meta['report_url']
+        yield NuforcReportItem(report)
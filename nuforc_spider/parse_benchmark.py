@@ -0,0 +1,91 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: parse_benchmark.py
+# Author: Ra Inta
+# Description: Micro-benchmark of the monthly index table parser used by the
+# nuforc spider. The saved index page (ndxLocOut_example.html) only holds a
+# handful of reports, so the table body is replicated to the size of a busy
+# month before timing. The original column-wise parser (one XPath sweep of
+# the whole document per column) is kept here as the reference, so we can
+# check the spider's row-wise parser (parseIndexPage) returns exactly the
+# same columns.
+#
+# Run from this directory:
+# $ python parse_benchmark.py [n_rows]
+#
+###########################################
+
+import os
+import re
+import sys
+import timeit
+from urllib.parse import urljoin
+
+from scrapy.http import HtmlResponse
+
+from nuforc.parsing import base_url, names, parseIndexPage, parsePageDates
+
+example_page = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "ndxLocOut_example.html")
+page_url = "http://www.nuforc.org/webreports/ndxe195007.html"
+
+
+def getTableElement(n, response):
+    """The original column-wise extraction: one sweep of the document for the
+    n-th cell of every table row."""
+    x_string = '//table//td[' + str(n) + ']'
+    return [''.join(x.xpath('.//text()').extract()) for x in response.xpath(x_string)]
+
+
+def columnWiseParse(response):
+    """Reference parser, as the spider did it before the row-wise pass."""
+    year, month = parsePageDates(response.url)
+    columns = {}
+    columns["date_time"] = getTableElement(1, response)
+    columns["city"] = getTableElement(2, response)
+    columns["state"] = getTableElement(3, response)
+    columns["shape"] = getTableElement(4, response)
+    columns["duration"] = getTableElement(5, response)
+    columns["posted"] = getTableElement(7, response)
+    columns["url"] = [urljoin(base_url, x) for x in response.xpath('//table//td//a//@href').extract()]
+    columns["year"] = [year] * len(columns["date_time"])
+    columns["month"] = [month] * len(columns["date_time"])
+    return columns
+
+
+def rowWiseParse(response):
+    """The single-pass parser the spider now uses, pivoted to columns for comparison."""
+    rows = parseIndexPage(response)
+    return {name: [row[i] for row in rows] for i, name in enumerate(names)}
+
+
+def buildResponse(n_rows):
+    """Replicate the data rows of the saved page until it holds at least n_rows."""
+    with open(example_page, 'rb') as html_file:
+        body = html_file.read().decode('windows-1252')
+    head, rest = body.split("<tbody>", 1)
+    rows, tail = rest.split("</tbody>", 1)
+    n_page_rows = len(re.findall("<tr", rows))
+    copies = max(1, -(-n_rows // n_page_rows))
+    body = head + "<tbody>" + rows * copies + "</tbody>" + tail
+    return HtmlResponse(url=page_url, body=body, encoding='windows-1252'), n_page_rows * copies
+
+
+if __name__ == "__main__":
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    response, n_rows = buildResponse(n_rows)
+    if columnWiseParse(response) != rowWiseParse(response):
+        sys.exit("Row-wise parser output differs from the column-wise parser!")
+    print("Parsed columns match for {0} rows".format(n_rows))
+    for label, parser in [("column-wise", columnWiseParse), ("row-wise", rowWiseParse)]:
+        # Re-wrap the response each time so the parsed lxml tree isn't cached
+        timings = timeit.repeat(lambda: parser(response.replace(body=response.body)), number=1, repeat=5)
+        best = min(timings)
+        print("{0:>12}: {1:8.2f} ms per page, {2:6.2f} us per row".format(
+            label, 1e3*best, 1e6*best/n_rows))
+
+
+###########################################
+# End of parse_benchmark.py
+###########################################
@@ -36,6 +36,26 @@ mpl.rcParams.update(
 # Comma Separated Variable (CSV) file.
 ufo_df = pd.read_csv("national_ufo_reports.csv")
 
+# If you have pyarrow installed, the spider also writes a typed, columnar
+# copy of the reports, partitioned by year and month. This loads in a fraction
+# of the time, with shape and state already categorical and a proper
+# event_time. You can also ask for only the columns and years you need, e.g.:
+# from ufo_data import readReportsDataset
+# ufo_df = readReportsDataset(columns=['year', 'month', 'shape', 'event_time'], years=(1947, 2018))
+# Otherwise, loadReports() reads the CSV with explicit types and builds the
+# event_time (see 'Dates and TimeSeries', below) in about a tenth of the time:
+# from ufo_data import loadReports
+# ufo_df = loadReports()
+# For many decades of reports, loadReports(compact=True) holds the same table in
+# a fraction of the memory: categorical city/state/shape, the URL as two small
+# integers, durations in seconds and a boolean smartphone_epoch.
+# And to just re-run the whole analysis below (loading, cleaning the cities,
+# joining the census populations, counting and plotting) on new or extended
+# data, ufo_pipeline.py has it in stages. The cleaning can be split into
+# chunks of rows over several processes, with the same results as in one:
+# from ufo_pipeline import runAnalysis
+# ufo_df, results = runAnalysis(details="national_ufo_report_details.csv", processes=32, plots=True)
+
 # As a naming convention, we often put a _df at the end of a variable name to
 # remind us that it is a DataFrame object. Recall a DataFrame is a collection of
 # Series objects. For a wide format, it is helpful to think of each column as a
@@ -179,6 +199,12 @@ ufo_df.isnull().sum()  # Note the chaining of methods. This powerful concept wil
 # data'; it has the same Latin roots as for input, and is similar to that
 # for amputation (which is roughly 'to clean by cutting back'))!
 
+# The durations are free text ('15 minutes', '2-3 min', 'approx 1 hr'...), so
+# can't be used as they are. ufo_durations.py turns them into seconds, along
+# with whether the witness gave a definite duration:
+# from ufo_durations import duration_cache
+# ufo_df[['duration_seconds', 'duration_confident']] = duration_cache.parse(ufo_df['duration']).values
+
 ## Filtering
 # Do we need to filter by year?
 # The dates prior to 1900 are likely to be based on heavy, retrospective,
@@ -261,7 +287,9 @@ ufo_df = pd.read_csv("national_ufo_reports.csv", parse_dates=[0], keep_date_col=
 # entered in the 'event_time' field. Then, extract only the 'day' information as
 # another column:
 
-ufo_df['day'] = [x.day for x in ufo_df['date_time']]
+# ufo_df['day'] = [x.day for x in ufo_df['date_time']]
+# ...or, without a Python loop over every Timestamp:
+ufo_df['day'] = ufo_df['date_time'].dt.day
 
 # We can then concatenate the year, month and day Series as a single datetime
 # Series...
@@ -292,6 +320,11 @@ ufo_df['event_time'].max()
 
 # Timestamp('2018-08-30 00:00:00')
 
+# All of the above is done by loadReports() in ufo_data.py, in one vectorized
+# step: it takes the year and month from the URL and only the day and time from
+# 'date_time', and keeps the times to the second (rather than the nanosecond),
+# so the reports before 1678 don't have to be dropped.
+
 ## Graphical analysis.
 # Pandas has support for a wide range of graphical analysis. Effectively there
 # are a number of wrappers to the matplotlib Python library.
@@ -323,13 +356,28 @@ plt.show()
 # We will have to aggregate over year and count the number of occurences. We do
 # this aggregation with the .groupby() operation.
 ufo_df.groupby('year')['posted'].count().reset_index().plot(x='year', y='posted', xlim=[1920.0, 2020.0], legend=False)
+
+# Every one of these charts re-groups all of the reports. The counts by year,
+# month, state, shape and city can be saved once, as a 'cube', and only updated
+# when the spider writes new months (see ufo_cube.py). Then each chart takes
+# milliseconds, e.g.:
+# from ufo_cube import loadCube
+# cube = loadCube()
+# cube.counts('year').rename('posted').reset_index().plot(x='year', y='posted', xlim=[1920.0, 2020.0], legend=False)
+# cube.counts('month', years=(2007, None)) is the post-smartphone histogram below,
+# and cube.counts('shape'), cube.counts('state') and cube.counts('city') the
+# others.
 plt.xlabel("Year of report")
 plt.ylabel("Number of reports")
 plt.title("Increase in UFO reports over time", fontname="Covert Ops", fontsize=16)
 plt.savefig("UFO_observations_over_years.png")
 
 # The smart phone was introduced around the middle of 2007 (more or less)
-ufo_df['smartphone_epoch'] = ['pre-smartphone' if x < 2007 else 'post-smartphone' for x in ufo_df['year']]
+# ufo_df['smartphone_epoch'] = ['pre-smartphone' if x < 2007 else 'post-smartphone' for x in ufo_df['year']]
+# This is a special case of splitting the reports into eras by a list of cutoffs
+# (see ufo_eras.py), as a categorical:
+from ufo_eras import annualRates, bucketEras
+ufo_df['smartphone_epoch'] = bucketEras(ufo_df['year'], [2007], ['pre-smartphone', 'post-smartphone'])
 
 ufo_df[ufo_df['smartphone_epoch'] == 'post-smartphone']['month'].plot.hist(bins=12, color='blue', alpha=0.5, label="post-smartphone", legend=True)
 ufo_df[ufo_df['smartphone_epoch'] == 'pre-smartphone']['month'].plot.hist(bins=12, color='red', alpha=0.5, label="pre-smartphone", legend=True)
@@ -344,8 +392,17 @@ plt.title("Effect of technology on reports by month", fontname="Alien Invasion",
 plt.savefig("UFO_effect_of_tech_by_month.png")
 
 
-ufo_df[ufo_df['smartphone_epoch'] == 'post-cellphone'].groupby('year')['posted'].count().mean()  # 5797.75
-ufo_df[ufo_df['smartphone_epoch'] == 'pre-cellphone'].groupby('year')['posted'].count().mean()  # 432.75
+# (These used to look for 'post-cellphone' and 'pre-cellphone', which aren't
+# labels of smartphone_epoch, and so quietly gave NaN)
+ufo_df[ufo_df['smartphone_epoch'] == 'post-smartphone'].groupby('year')['posted'].count().mean()  # 5797.75
+ufo_df[ufo_df['smartphone_epoch'] == 'pre-smartphone'].groupby('year')['posted'].count().mean()  # 432.75
+
+# The same, for every era at once:
+annualRates(ufo_df['year'], [2007], ['pre-smartphone', 'post-smartphone'])['reports_per_year']
+
+# ...which makes it easy to try other technologies, e.g. the web and the
+# smartphone:
+annualRates(ufo_df['year'], [1995, 2007], ['pre-web', 'web', 'smartphone'])
 
 
 plt.show()
@@ -411,7 +468,7 @@ ufo_df[ufo_df['city'] == 'New York'].count()
 
 # While we are at it, there are a few entries that have non-standard
 # capitalization (such as 'AmArillo'), we we enforce this with .title():
-ufo_df['city'] = [x.title().split(sep=" (")[0] for x in ufo_df['city']]
+# ufo_df['city'] = [x.title().split(sep=" (")[0] for x in ufo_df['city']]
 
 # There are still 20 cities with parentheses, and at least one with '{'s. I
 # was hoping it wouldn't come to this...
@@ -420,7 +477,17 @@ ufo_df['city'] = [x.title().split(sep=" (")[0] for x in ufo_df['city']]
 import re
 
 # Remove anything following a [, ( or {:
-ufo_df['city'] = [re.split("\s*[\(\{]", x.title())[0] for x in ufo_df['city']]
+# ufo_df['city'] = [re.split("\s*[\(\{]", x.title())[0] for x in ufo_df['city']]
+
+# There are a few more of these rules below. Each of those list comprehensions
+# loops over all ~116,000 rows in Python, and there are only ~20,000 distinct
+# city names. So instead, all of the rules (see city_rules in ufo_cities.py)
+# are compiled once and applied as vectorized string methods, once per
+# distinct name, and the results mapped back onto the rows. Same answer, in a
+# fraction of the time (python ufo_benchmark.py cities):
+from ufo_cities import normalizeCities
+
+ufo_df['city'] = normalizeCities(ufo_df['city'])
 
 # Check nothing went awry (as sometimes occurs with regex's!)
 ufo_df.dropna()[ufo_df['city'].dropna().str.contains("\)$|\(")]
@@ -434,6 +501,7 @@ ufo_df.loc[25404, 'city'] = 'Cedar Rapids'
 
 ufo_df[ufo_df['city'].str.contains("New York")]['city'].unique()
 
+# Before the '/' and '&' rules below, this gave:
 # array(['New York City', 'New York', 'New York Mills', 'West New York',
 #        'New York State Thruway / Catskill', 'New York City, Manhattan',
 #        'New York City/Far Rockaway', 'New York City/Staten Island',
@@ -447,9 +515,10 @@ ufo_df[ufo_df['city'].str.contains("New York")]['city'].unique()
 # There are plenty of locations that are between main population centers, often
 # separated by a '/' or a '&'. Most cases, the larger settlement is on the left of the
 # slash or ampersand.
-ufo_df['city'] = [re.sub("\s*/.*", "", x.title()) for x in ufo_df['city']]
-ufo_df['city'] = [re.sub("\s*&.*", "", x.title()) for x in ufo_df['city']]
-ufo_df['city'] = [re.sub("^[Bb]etween", ",", x.title()) for x in ufo_df['city']]
+# (These rules are also part of normalizeCities, above.)
+# ufo_df['city'] = [re.sub("\s*/.*", "", x.title()) for x in ufo_df['city']]
+# ufo_df['city'] = [re.sub("\s*&.*", "", x.title()) for x in ufo_df['city']]
+# ufo_df['city'] = [re.sub("^[Bb]etween", ",", x.title()) for x in ufo_df['city']]
 
 # CHECK
 ufo_df[ufo_df['city'].str.contains("New York")]['city'].unique()
@@ -484,28 +553,43 @@ for uniq in uniq_ny:
 #        name_count.append((uniq, df[df['city'] == uniq]['city'].count()))
 #    return name_count
 
+#def getUniqueSimilarCities(df, city_name):
+#    """docstring for getUniqueSimilarCities"""
+#    uniq_list = df[df['city'].str.contains(city_name)]['city'].unique()
+#    count_df = pd.DataFrame(uniq_list, columns=['city'])
+#    name_count = []
+#    for uniq in uniq_list:
+#        name_count.append(df[df['city'] == uniq]['city'].count())
+#    count_df['count'] = name_count
+#    return count_df.sort_values('count', ascending=False)
+
+# That scans every report once for the city name, then once more for each
+# match. Much faster to count the distinct names once and index them (see
+# ufo_cities.py); lookups then take microseconds:
+from ufo_cities import CityIndex
+city_index = CityIndex(ufo_df['city'])
+
+
 def getUniqueSimilarCities(df, city_name):
-    """docstring for getUniqueSimilarCities"""
-    uniq_list = df[df['city'].str.contains(city_name)]['city'].unique()
-    count_df = pd.DataFrame(uniq_list, columns=['city'])
-    name_count = []
-    for uniq in uniq_list:
-        name_count.append(df[df['city'] == uniq]['city'].count())
-    count_df['count'] = name_count
-    return count_df.sort_values('count', ascending=False)
+    """Distinct city names in df containing city_name, with their number of
+    reports, most reports first. Looks them up in city_index, so rebuild that
+    if df['city'] changes."""
+    return city_index.similar(city_name)
+
 
+# All of the census cities in one go:
+similar_cities = city_index.similarMany(city_pop['city'].head(100).tail(50))
 
 counter = 0
-for Idx in city_pop['city'].head(100).tail(50):
-    Z = getUniqueSimilarCities(ufo_df, Idx)
-    fraction_remainder = Z['count'][1:].sum()/Z['count'].sum()
-    fraction_secondary = 1 - Z['count'][0:2].sum()/Z['count'].sum()
+for Idx, Z in similar_cities.groupby('query', sort=False):
+    fraction_remainder = Z['count'].iloc[1:].sum()/Z['count'].sum()
+    fraction_secondary = 1 - Z['count'].iloc[0:2].sum()/Z['count'].sum()
     if fraction_remainder > 0.05:
         counter += 1
         print(
             "{0} City: {1} Fraction of similar city names {2:.2%};\
             fraction of primary and secondary only {3:.2%}".format(
-                counter, Z['city'][0], fraction_remainder, fraction_secondary)
+                counter, Z['city'].iloc[0], fraction_remainder, fraction_secondary)
         )
 
 #getUniqueSimilarCities(ufo_df, "Chicago")
@@ -513,29 +597,36 @@ for Idx in city_pop['city'].head(100).tail(50):
 ##################################################
 
 
-def purgeDirectionalModifiers(df, city_name):
-    """Strip off directional prefixes North, South etc. from city names in DataFrame df"""
-    direction_list = ["North", "N.", "East", "E.", "South", "S.", "West", "W."]
-    direction_regex = re.compile(' |'.join(direction_list) + ' ')
-    match_idx = df['city'].str.contains(city_name).index
-    df['city'].loc[match_idx] = [re.sub(direction_regex, "", x) for x in df['city'].loc[match_idx]]
-
-
-def purgeCitySuffix(df, city_name):
-    """Strip specifiers for city, county etc."""
-    suffix_list = ["City", "County", "Area", "Bay", "Airport", "D.C.", "Dc", ","]
-    suffix_regex = re.compile(' ' + '$| '.join(suffix_list) + "$")
-    match_idx = df['city'].str.contains(city_name).index
-    df['city'].loc[match_idx] = [re.sub(suffix_regex, "", x) for x in df['city'].loc[match_idx]]
-
+#def purgeDirectionalModifiers(df, city_name):
+#    """Strip off directional prefixes North, South etc. from city names in DataFrame df"""
+#    direction_list = ["North", "N.", "East", "E.", "South", "S.", "West", "W."]
+#    direction_regex = re.compile(' |'.join(direction_list) + ' ')
+#    match_idx = df['city'].str.contains(city_name).index
+#    df['city'].loc[match_idx] = [re.sub(direction_regex, "", x) for x in df['city'].loc[match_idx]]
+#
+#
+#def purgeCitySuffix(df, city_name):
+#    """Strip specifiers for city, county etc."""
+#    suffix_list = ["City", "County", "Area", "Bay", "Airport", "D.C.", "Dc", ","]
+#    suffix_regex = re.compile(' ' + '$| '.join(suffix_list) + "$")
+#    match_idx = df['city'].str.contains(city_name).index
+#    df['city'].loc[match_idx] = [re.sub(suffix_regex, "", x) for x in df['city'].loc[match_idx]]
+
+# Careful! The index of str.contains() is the index of _every_ row, not just
+# the matching ones, so the above rewrote the whole column twice for every city
+# (and the unescaped '.'s in 'N.' etc. match any character). Instead, strip the
+# prefixes and suffixes in one pass, only from the names containing one of the
+# cities (see ufo_cities.py):
+from ufo_cities import purgeCityModifiers
 
 cities_to_clean = ["Sacramento", "Seattle", "Milwaukee", "Baltimore",
                    "Las Vegas", "Boston", "San Francisco", "Washington",
                    "Chicago", "Los Angeles", "New York"]
 
-for city in cities_to_clean:
-    purgeDirectionalModifiers(ufo_df, city)
-    purgeCitySuffix(ufo_df, city)
+#for city in cities_to_clean:
+#    purgeDirectionalModifiers(ufo_df, city)
+#    purgeCitySuffix(ufo_df, city)
+ufo_df['city'], n_purged = purgeCityModifiers(ufo_df['city'], cities_to_clean)
 
 # How many cities are there in this data set?
 len(ufo_df['city'].unique())  # 18,366
@@ -556,6 +647,8 @@ plt.savefig("UFO_observations_by_city.png")
 # The US census bureau for the 770 most populous cities:
 # https://factfinder.census.gov/faces/tableservices/jsf/pages/productview.xhtml
 # However, there are far too many columns for our needs.
+# (All of the cleaning below is also done by ufo_gazetteer.py, which saves the
+# result, with the populations for every year from 2010 to 2017, for next time.)
 city_pop = pd.read_csv("PEP_2017_PEPANNRSIP.US12A_with_ann.csv",
                        encoding='latin-1')
 
@@ -711,6 +804,35 @@ A.sort_values('obs_per_1000', ascending=False).head(25)
 # Wow! Who would have thought that Tinley Park, Illinois would have the most UFO
 # reports per capita? The second, Sarasota, FL, isn't even close!
 
+# The populations grew over the years, though, so it is fairer to count each
+# report against the population of its city in the year it was made (2010 to
+# 2017; reports from before or after take the nearest year). The saved gazetteer
+# of the census cities does this without any of the merges above, looking up
+# each city's integer id instead:
+from ufo_gazetteer import loadGazetteer, perCapitaRates
+gazetteer = loadGazetteer()
+perCapitaRates(ufo_df, gazetteer).head(25)
+
+# Only the reports whose city is spelled exactly as in the census are counted,
+# though (cities_to_clean, above, only fixed a few big cities by hand). The
+# CityMatcher also tries the names without punctuation, 'city' etc. ('St Louis'
+# for 'St. Louis'), then the most similar name among the census cities in the
+# same state that start the same way or sound alike ('Pheonix' for 'Phoenix'):
+from ufo_gazetteer import CityMatcher, matchRates
+matched = CityMatcher(gazetteer).match(ufo_df['city'])
+matchRates(matched)
+perCapitaRates(ufo_df, gazetteer, city_ids=matched['city_id']).head(25)
+
+# Some sightings are listed several times, though: several witnesses report
+# them, or they are posted again later, which inflates these counts. ufo_dedup.py
+# clusters the reports of the same hour, city, state and shape (and, with the
+# report details, nearly the same description), so each sighting counts once:
+from ufo_dedup import loadDuplicates
+duplicates = loadDuplicates()
+ufo_df['cluster_id'] = duplicates.clusterIds(ufo_df['url'])
+sightings = duplicates.dedupe(ufo_df)
+perCapitaRates(sightings, gazetteer, city_ids=matched['city_id'][sightings.index]).head(25)
+
 A.sort_values('obs_per_1000', ascending=False)['obs_per_1000'].head(10).plot.barh(legend=False)
 plt.gca().invert_yaxis()
 plt.ylabel("City")
@@ -755,6 +877,34 @@ M = ufo_merged[ufo_merged['city'] == 'Aurora, TX']
 plt.hist(M['year'], bins=100)
 # Just a single observation, from 1897
 
+# Rather than a histogram per city, every city's reports per day can be scored
+# against its previous year at once (see ufo_bursts.py), and the unusual bursts
+# ranked, which should bring up the Phoenix lights of 13 March 1997:
+# from ufo_bursts import DailyCounts, burstScores, flapEvents
+# city_days = DailyCounts.fromReports(ufo_merged, time_column='date_time')
+# flapEvents(burstScores(city_days)).head(20)
+# city_days.series('Phoenix, AZ').loc['1997'].plot()
+# flapEvents(burstScores(DailyCounts.fromReports(ufo_merged, by='state', time_column='date_time')))
+
+# Each of these scans every report for an exact city name, so misses reports
+# from the next town over. With the census Gazetteer of places (see ufo_geo.py)
+# the reports can be put on the map, and a grid index over them answers
+# questions about an area in about a millisecond:
+# from ufo_geo import ReportIndex, geocode, loadPlaces, placeLocation
+# places = loadPlaces()
+# ufo_locations = geocode(ufo_df['city'].str.rsplit(', ', n=1).str[0], ufo_df['state'], places)
+# report_index = ReportIndex(ufo_locations['lat'], ufo_locations['lon'], ufo_df['year'])
+# lat, lon = placeLocation(places, 'Roswell', 'NM')
+# ufo_df.iloc[report_index.within(lat, lon, 50, years=(1947, 1950))]  # within 50 km of Roswell
+# ufo_df.iloc[report_index.inBox(31.3, -109.1, 37.0, -103.0)]  # all of New Mexico, roughly
+# And for asking about one city at a time over and over, the reports can be
+# sorted by city and time once (see ufo_query.py), so each query is a couple of
+# binary searches returning a slice, rather than a scan of every report:
+# from ufo_query import ReportTable
+# reports = ReportTable(ufo_merged, time_column='date_time')
+# reports.city('Phoenix, AZ', start=dt.datetime(1966, 1, 1))
+# reports.city('Roswell, NM', start=1947, end=1948)
+
 
 # Other notes: over 720 labels of 'HOAX' in the summary pages
 
@@ -0,0 +1,353 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: ufo_benchmark.py
+# Author: Ra Inta
+# Description: Benchmarks for the analysis helpers, each checking the new
+# code gives exactly the same answer as the original approach in
+# ufo_analysis.py before timing the two. Run with the name of a benchmark:
+# $ python ufo_benchmark.py cities [national_ufo_reports.csv]
+# $ python ufo_benchmark.py similar [national_ufo_reports.csv]
+# $ python ufo_benchmark.py purge [national_ufo_reports.csv]
+# $ python ufo_benchmark.py memory [national_ufo_reports.csv]
+# $ python ufo_benchmark.py durations [national_ufo_reports.csv]
+# $ python ufo_benchmark.py matching [national_ufo_reports.csv]
+# $ python ufo_benchmark.py queries [national_ufo_reports.csv]
+# $ python ufo_benchmark.py bursts [national_ufo_reports.csv]
+# $ python ufo_benchmark.py dedup [national_ufo_reports.csv]  (with the report details)
+# $ python ufo_benchmark.py geo [national_ufo_reports.csv]
+#
+###########################################
+
+import os
+import re
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from ufo_bursts import DailyCounts, burstScores
+from ufo_data import compactReports, details_filename, eventTimes, readReportDetails
+from ufo_dedup import DuplicateClusters, linkClusters
+from ufo_durations import DurationCache
+from ufo_gazetteer import CityMatcher, cityIds, loadGazetteer, matchRates
+from ufo_geo import ReportIndex, distancesKm, wrapLongitudes
+from ufo_query import ReportTable
+from ufo_cities import CityIndex, normalizeCities, purgeCityModifiers
+
+
+def timeBoth(label, original, new, repeat=3):
+    """Best of repeat timings of the original and new functions."""
+    original_time = min(timeit.repeat(original, number=1, repeat=repeat))
+    new_time = min(timeit.repeat(new, number=1, repeat=repeat))
+    print("{0}: original {1:.3f} s, new {2:.3f} s ({3:.1f}x faster)".format(
+        label, original_time, new_time, original_time/new_time))
+
+
+def originalCityCleaning(cities):
+    """The city cleaning, exactly as it was done in ufo_analysis.py."""
+    cities = [x.title().split(sep=" (")[0] for x in cities]
+    cities = [re.split(r"\s*[\(\{]", x.title())[0] for x in cities]
+    cities = [re.sub(r"\s*/.*", "", x.title()) for x in cities]
+    cities = [re.sub(r"\s*&.*", "", x.title()) for x in cities]
+    cities = [re.sub("^[Bb]etween", ",", x.title()) for x in cities]
+    return cities
+
+
+def benchmarkCities(ufo_df):
+    cities = ufo_df['city'].dropna()
+    if originalCityCleaning(cities) != normalizeCities(cities).tolist():
+        sys.exit("normalizeCities differs from the original city cleaning!")
+    print("normalizeCities matches the original cleaning for {0} rows ({1} distinct cities)".format(
+        len(cities), cities.nunique()))
+    timeBoth("City cleaning", lambda: originalCityCleaning(cities), lambda: normalizeCities(cities))
+
+
+def originalSimilarCities(df, city_name):
+    """getUniqueSimilarCities, as it was in ufo_analysis.py (but matching the
+    plain name, rather than a regex)."""
+    uniq_list = df[df['city'].str.contains(city_name, regex=False)]['city'].unique()
+    count_df = pd.DataFrame(uniq_list, columns=['city'])
+    name_count = []
+    for uniq in uniq_list:
+        name_count.append(df[df['city'] == uniq]['city'].count())
+    count_df['count'] = name_count
+    return count_df.sort_values('count', ascending=False)
+
+
+def benchmarkSimilar(ufo_df, n_queries=50):
+    ufo_df = ufo_df.dropna(subset=['city'])
+    ufo_df = ufo_df.assign(city=normalizeCities(ufo_df['city']))
+    queries = ufo_df['city'].value_counts().index[:n_queries].tolist()
+    city_index = CityIndex(ufo_df['city'])
+    for city_name in queries:
+        original = originalSimilarCities(ufo_df, city_name)
+        similar = city_index.similar(city_name)
+        if sorted(zip(original['city'], original['count'])) != sorted(zip(similar['city'], similar['count'])):
+            sys.exit("CityIndex differs from getUniqueSimilarCities for {0}!".format(city_name))
+    print("CityIndex matches getUniqueSimilarCities for the {0} most reported cities".format(len(queries)))
+    timeBoth("Similar cities ({0} lookups)".format(len(queries)),
+             lambda: [originalSimilarCities(ufo_df, city_name) for city_name in queries],
+             lambda: CityIndex(ufo_df['city']).similarMany(queries))
+    timeBoth("Similar cities ({0} lookups, index already built)".format(len(queries)),
+             lambda: [originalSimilarCities(ufo_df, city_name) for city_name in queries],
+             lambda: city_index.similarMany(queries))
+
+
+cities_to_clean = ["Sacramento", "Seattle", "Milwaukee", "Baltimore",
+                   "Las Vegas", "Boston", "San Francisco", "Washington",
+                   "Chicago", "Los Angeles", "New York"]
+
+
+def originalPurge(df, city_names, masked=False):
+    """purgeDirectionalModifiers and purgeCitySuffix, as they were in
+    ufo_analysis.py: every city rewrites every row, twice. With masked, as
+    they were meant to be: only the rows containing the city are rewritten,
+    and the '.'s of 'N.', 'D.C.' etc. only match a '.'."""
+    direction_list = ["North", "N.", "East", "E.", "South", "S.", "West", "W."]
+    suffix_list = ["City", "County", "Area", "Bay", "Airport", "D.C.", "Dc", ","]
+    if masked:
+        direction_list = [re.escape(x) for x in direction_list]
+        suffix_list = [re.escape(x) for x in suffix_list]
+    original_direction_regex = re.compile(' |'.join(direction_list) + ' ')
+    original_suffix_regex = re.compile(' ' + '$| '.join(suffix_list) + "$")
+    cities = df['city'].copy()
+    for city_name in city_names:
+        match = cities.str.contains(city_name)
+        match_idx = cities.index[match] if masked else match.index
+        cities.loc[match_idx] = [re.sub(original_direction_regex, "", x) for x in cities.loc[match_idx]]
+        match = cities.str.contains(city_name)
+        match_idx = cities.index[match] if masked else match.index
+        cities.loc[match_idx] = [re.sub(original_suffix_regex, "", x) for x in cities.loc[match_idx]]
+    return cities
+
+
+def benchmarkPurge(ufo_df):
+    ufo_df = ufo_df.dropna(subset=['city'])
+    ufo_df = ufo_df.assign(city=normalizeCities(ufo_df['city']))
+    cities = ufo_df['city']
+    purged, n_purged = purgeCityModifiers(cities, cities_to_clean)
+    if originalPurge(ufo_df, cities_to_clean, masked=True).tolist() != purged.tolist():
+        sys.exit("purgeCityModifiers differs from the original, only rewriting the matching rows!")
+    original = originalPurge(ufo_df, cities_to_clean)
+    matching = cities.str.contains('|'.join(cities_to_clean))
+    print("Rows rewritten: original {0}, new {1} (of which {2} changed)".format(
+        2*len(cities_to_clean)*len(cities), matching.sum(), n_purged))
+    print("Rows the original changed that don't contain any of the cities: {0}".format(
+        ((original != cities) & ~matching).sum()))
+    print("Rows containing a city that the original's unescaped '.'s cleaned differently: {0}".format(
+        ((original != purged) & matching).sum()))
+    timeBoth("City prefix/suffix purge", lambda: originalPurge(ufo_df, cities_to_clean),
+             lambda: purgeCityModifiers(cities, cities_to_clean))
+
+
+def benchmarkMemory(ufo_df):
+    # As in ufo_analysis.py, with the strings as Python objects
+    ufo_df = ufo_df.astype(dict((column, object) for column in ufo_df.columns if ufo_df[column].dtype == 'str'))
+    ufo_df['smartphone_epoch'] = ['pre-smartphone' if x < 2007 else 'post-smartphone' for x in ufo_df['year']]
+    compact = compactReports(ufo_df, durations=None)
+    before = ufo_df.memory_usage(deep=True)
+    after = compact.memory_usage(deep=True)
+    print(pd.DataFrame({'before (MB)': before/1e6, 'after (MB)': after/1e6}).round(3).fillna('').to_string())
+    print("Total: before {0:.1f} MB, after {1:.1f} MB ({2:.1f}x smaller)".format(
+        before.sum()/1e6, after.sum()/1e6, before.sum()/after.sum()))
+
+
+def benchmarkDurations(ufo_df):
+    durations = ufo_df['duration']
+    timings = timeit.repeat(lambda: DurationCache().parse(durations), number=1, repeat=3)
+    print("Parsing {0} durations ({1} distinct): {2:.3f} s".format(
+        len(durations), durations.nunique(), min(timings)))
+    cache = DurationCache()
+    # The same again (as for a reload), and with another 1% of new durations
+    parsed = cache.parse(durations)
+    reloaded = durations.copy()
+    reloaded.iloc[::100] = reloaded.iloc[::100] + ' or so'
+    print("Parsing them again, with the cache: {0:.3f} s; with 1% new: {1:.3f} s".format(
+        min(timeit.repeat(lambda: cache.parse(durations), number=1, repeat=3)),
+        min(timeit.repeat(lambda: cache.parse(reloaded), number=1, repeat=1))))
+    print("{0:.1%} parsed to seconds, {1:.1%} of them definite".format(
+        parsed['seconds'].notna().mean(), parsed['confident'].sum()/parsed['seconds'].notna().sum()))
+
+
+def benchmarkMatching(ufo_df):
+    # The cities as they are by the per-capita section of ufo_analysis.py
+    ufo_df = ufo_df.dropna(subset=['city', 'state'])
+    cities, n_purged = purgeCityModifiers(normalizeCities(ufo_df['city']), cities_to_clean)
+    cities = cities + ', ' + ufo_df['state']
+    gazetteer = loadGazetteer()
+    exact = (cityIds(gazetteer, cities) >= 0).mean()
+    start = timeit.default_timer()
+    matched = CityMatcher(gazetteer).match(cities)
+    elapsed = timeit.default_timer() - start
+    print("Matched {0} reports ({1} distinct cities) to the census cities in {2:.2f} s".format(
+        len(cities), cities.nunique(), elapsed))
+    print("Exact matches only: {0:.1%} of reports; with the CityMatcher: {1:.1%}".format(
+        exact, (matched['city_id'] >= 0).mean()))
+    print(matchRates(matched).to_string())
+
+
+def benchmarkQueries(ufo_df, scale=10, n_queries=200):
+    # Many decades more reports: the reports, scale times over
+    ufo_df = ufo_df.assign(city=ufo_df['city'] + ', ' + ufo_df['state'],
+                           event_time=eventTimes(ufo_df['year'], ufo_df['month'], ufo_df['date_time']))
+    ufo_df = pd.concat([ufo_df]*scale, ignore_index=True)
+    cities = ufo_df['city'].dropna().sample(n_queries, random_state=1).tolist()
+    starts = [int(year) for year in ufo_df['year'].sample(n_queries, random_state=2)]
+    queries = [(city, start, start + 5) for city, start in zip(cities, starts)]
+
+    def maskQueries():
+        return [ufo_df[(ufo_df['city'] == city) & (ufo_df['event_time'] >= pd.Timestamp(start, 1, 1))
+                       & (ufo_df['event_time'] < pd.Timestamp(end, 1, 1))] for city, start, end in queries]
+
+    start = timeit.default_timer()
+    reports = ReportTable(ufo_df)
+    print("Sorted {0} reports in {1:.3f} s".format(len(ufo_df), timeit.default_timer() - start))
+
+    def tableQueries():
+        return [reports.city(city, start, end) for city, start, end in queries]
+
+    for masked, sliced in zip(maskQueries(), tableQueries()):
+        if sorted(masked.index) != sorted(sliced.index):
+            sys.exit("ReportTable differs from the boolean masks!")
+    print("ReportTable matches the boolean masks for {0} queries".format(n_queries))
+    timeBoth("{0} city and 5 year queries".format(n_queries), maskQueries, tableQueries)
+
+
+def loopBurstScores(ufo_df, window=365, min_reports=3, prior=1.0):
+    """burstScores one city at a time: a rolling sum over each city's
+    reports per day."""
+    scores = []
+    for city, reports in ufo_df.dropna(subset=['event_time']).groupby('city'):
+        daily = reports['event_time'].dt.floor('D').value_counts().sort_index().asfreq('D', fill_value=0)
+        expected = (daily.rolling(window, min_periods=1).sum().shift(1, fill_value=0) + prior)/window
+        daily, expected = daily[daily >= min_reports], expected[daily >= min_reports]
+        score = np.where(daily > expected, daily*np.log(daily/expected) - (daily - expected), 0.0)
+        scores.append(pd.DataFrame({'name': city, 'date': daily.index, 'reports': daily.to_numpy(),
+                                    'expected': expected.to_numpy(), 'score': score}))
+    return pd.concat(scores, ignore_index=True)
+
+
+def benchmarkBursts(ufo_df):
+    ufo_df = ufo_df.assign(city=normalizeCities(ufo_df['city']) + ', ' + ufo_df['state'],
+                           event_time=eventTimes(ufo_df['year'], ufo_df['month'], ufo_df['date_time']))
+    looped = loopBurstScores(ufo_df).sort_values(['name', 'date'], ignore_index=True)
+    scores = burstScores(DailyCounts.fromReports(ufo_df)).sort_values(['name', 'date'], ignore_index=True)
+    columns = ['name', 'date', 'reports']
+    if not (np.array_equal(looped[columns].to_numpy(), scores[columns].to_numpy())
+            and np.allclose(looped['score'], scores['score'])):
+        sys.exit("burstScores differs from scoring each city in turn!")
+    print("burstScores matches scoring each of {0} cities in turn ({1} days scored)".format(
+        ufo_df['city'].nunique(), len(scores)))
+    timeBoth("Burst scores", lambda: loopBurstScores(ufo_df),
+             lambda: burstScores(DailyCounts.fromReports(ufo_df)), repeat=1)
+
+
+def allPairsClusters(clusters, rows, chunk=500):
+    """The text clusters of DuplicateClusters, found by comparing the
+    signatures of every pair of rows in the same state."""
+    states = clusters.reports['state'].to_numpy(dtype=object)[rows]
+    signatures = clusters.signatures[rows]
+    firsts, seconds = [], []
+    for start in range(0, len(rows), chunk):
+        agreement = (signatures[start:start + chunk, None, :] == signatures[None, :, :]).mean(axis=2)
+        first, second = np.nonzero((agreement >= clusters.threshold)
+                                   & (states[start:start + chunk, None] == states[None, :]))
+        firsts.append(first + start)
+        seconds.append(second)
+    return linkClusters(len(rows), np.concatenate(firsts), np.concatenate(seconds))
+
+
+def benchmarkDedup(ufo_df, n_reports=5000):
+    if not os.path.exists(details_filename):
+        sys.exit("The dedup benchmark needs the report details ({0})".format(details_filename))
+    descriptions = readReportDetails(columns=['url', 'description']).drop_duplicates('url', keep='last')
+    ufo_df = ufo_df.merge(descriptions, on='url', how='left')
+    clusters = DuplicateClusters()
+    start = timeit.default_timer()
+    clusters.update(ufo_df)
+    print("Hashed {0} reports in {1:.3f} s".format(len(ufo_df), timeit.default_timer() - start))
+    # Every pair is only feasible for a sample: the reports with text from
+    # a few states (duplicates are always from the same state)
+    hashed = clusters.reports[clusters.reports['hashed']]
+    state_sizes = hashed['state'].value_counts().sample(frac=1, random_state=1)
+    states = state_sizes.index[np.cumsum(state_sizes.to_numpy()) - state_sizes.to_numpy() < n_reports]
+    rows = np.flatnonzero(clusters.reports['hashed'] & clusters.reports['state'].isin(states))
+    sample = DuplicateClusters(clusters.reports.iloc[rows].assign(key=None).reset_index(drop=True),
+                               clusters.signatures[rows])
+    all_pairs = allPairsClusters(clusters, rows)
+    lsh = sample.clusters()
+    # The clusters of more than one report by every pair, and whether LSH puts them together
+    groups = pd.Series(lsh).groupby(all_pairs)
+    found = (groups.nunique() == 1)[groups.size() > 1]
+    print("LSH finds {0} of the {1} duplicate texts found by comparing every pair of {2} reports".format(
+        found.sum(), len(found), len(rows)))
+    timeBoth("Text duplicates", lambda: allPairsClusters(clusters, rows),
+             lambda: DuplicateClusters(sample.reports, sample.signatures).clusters(), repeat=1)
+    start = timeit.default_timer()
+    ids = clusters.clusterIds(ufo_df['url'])
+    print("Clustered {0} reports into {1} sightings in {2:.3f} s".format(
+        len(ids), ids.nunique(), timeit.default_timer() - start))
+
+
+def benchmarkGeo(ufo_df, n_queries=200, radius_km=300):
+    # The CSV has no locations (see ufo_geo.geocode), so the reports are put
+    # at random across the lower 48, with a tenth of them along the Aleutians,
+    # which run across the antimeridian (Adak, AK is at -176.6)
+    rng = np.random.default_rng(1)
+    lats, lons = rng.uniform(25, 49, len(ufo_df)), rng.uniform(-125, -67, len(ufo_df))
+    aleutians = rng.random(len(ufo_df)) < 0.1
+    lats[aleutians] = rng.uniform(51, 55, aleutians.sum())
+    lons[aleutians] = wrapLongitudes(rng.uniform(172, 200, aleutians.sum()))
+    index = ReportIndex(lats, lons, ufo_df['year'])
+    centres = rng.choice(len(ufo_df), n_queries, replace=False)
+    # ...and some within radius_km of 180 degrees, from either side
+    queries = ([(lats[i], lons[i]) for i in centres]
+               + [(51.9, -176.6), (52.5, 179.9), (52.5, -179.9), (53.0, 180.0), (0.0, 179.9)])
+
+    def scanQueries():
+        return [np.flatnonzero(distancesKm(lat, lon, lats, lons) <= radius_km) for lat, lon in queries]
+
+    def indexQueries():
+        return [index.within(lat, lon, radius_km) for lat, lon in queries]
+
+    for scanned, found in zip(scanQueries(), indexQueries()):
+        if not np.array_equal(scanned, found):
+            sys.exit("ReportIndex.within differs from a full scan!")
+    boxes = [(50, 175, 56, -170), (50, 175, 56, 190), (30, -110, 40, -100), (-90, -180, 90, 180)]
+    for south, west, north, east in boxes:
+        # Degrees east of west, against the width of the box
+        width = east - west if east - west >= 360 else (east - west) % 360
+        in_box = (lats >= south) & (lats <= north) & ((lons - west) % 360 <= width)
+        if not np.array_equal(np.flatnonzero(in_box), index.inBox(south, west, north, east)):
+            sys.exit("ReportIndex.inBox differs from a full scan!")
+    print("ReportIndex matches a full scan for {0} radius and {1} box queries ({2} reports across 180 degrees)".format(
+        len(queries), len(boxes), len(index.within(52.5, 180.0, radius_km))))
+    timeBoth("{0} queries within {1} km".format(len(queries), radius_km), scanQueries, indexQueries)
+
+
+benchmarks = {
+    'cities': benchmarkCities,
+    'similar': benchmarkSimilar,
+    'purge': benchmarkPurge,
+    'memory': benchmarkMemory,
+    'durations': benchmarkDurations,
+    'matching': benchmarkMatching,
+    'queries': benchmarkQueries,
+    'bursts': benchmarkBursts,
+    'dedup': benchmarkDedup,
+    'geo': benchmarkGeo,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        sys.exit("Usage: python ufo_benchmark.py {0} [reports.csv]".format('|'.join(sorted(benchmarks))))
+    csv_filename = sys.argv[2] if len(sys.argv) > 2 else "national_ufo_reports.csv"
+    benchmarks[sys.argv[1]](pd.read_csv(csv_filename))
+
+
+###########################################
+# End of ufo_benchmark.py
+###########################################
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: ufo_bursts.py
+# Author: Ra Inta
+# Description: Finding 'flaps' (bursts of UFO reports, like the Phoenix
+# Lights of March 1997) without eyeballing a histogram for each city.
+# The reports are counted once into a sparse cities x days table (only the
+# days with reports are stored). Each of those days is scored against the
+# city's own reports over the year before it, as a Poisson rate, all at
+# once with NumPy; nearby high-scoring days make up a candidate event, e.g.:
+#
+# flapEvents(burstScores(DailyCounts.fromReports(ufo_df))).head(20)
+# flapEvents(burstScores(DailyCounts.fromReports(ufo_df, by='state')))
+#
+###########################################
+
+import numpy as np
+import pandas as pd
+
+# The table can be handed on as a scipy sparse matrix, if scipy is installed
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+
+class DailyCounts(object):
+    """The number of reports on each day for each city (or state, etc.),
+    as a sparse table: self.counts[i] reports on day self.days[i] (days
+    since 1970-01-01) for self.names[self.rows[i]], sorted by row then day.
+    Days without reports aren't stored."""
+
+    def __init__(self, rows, days, counts, names):
+        self.rows = rows
+        self.days = days
+        self.counts = counts
+        self.names = names
+
+    @classmethod
+    def fromReports(cls, ufo_df, by='city', time_column='event_time'):
+        """Count the reports of ufo_df per value of the by column (e.g.
+        'city', as 'City, ST', or 'state') and day of time_column. Reports
+        without either are left out."""
+        codes, names = pd.factorize(ufo_df[by])
+        days = ufo_df[time_column].to_numpy(dtype='datetime64[D]')
+        known = (codes >= 0) & ~np.isnat(days)
+        codes, days = codes[known].astype(np.int64), days[known].view(np.int64)
+        if not len(days):
+            return cls(codes, days, days, pd.Index(names))
+        # One integer per (row, day), so np.unique does the counting and sorting
+        first_day = days.min()
+        n_days = days.max() - first_day + 1
+        cells, counts = np.unique(codes*n_days + (days - first_day), return_counts=True)
+        return cls(cells // n_days, cells % n_days + first_day, counts, pd.Index(names))
+
+    def dayRange(self):
+        return (self.days.min(), self.days.max() + 1) if len(self.days) else (0, 0)
+
+    def toSparse(self):
+        """scipy.sparse CSR matrix of rows x days (from the first day with a
+        report)."""
+        if scipy is None:
+            raise ImportError("The sparse matrix requires scipy")
+        first_day, last_day = self.dayRange()
+        return scipy.sparse.csr_matrix((self.counts, (self.rows, self.days - first_day)),
+                                       shape=(len(self.names), last_day - first_day))
+
+    def series(self, name):
+        """Reports per day for one city (or state), including the days
+        without any, from its first report to its last."""
+        row = self.names.get_loc(name)
+        first, last = np.searchsorted(self.rows, [row, row + 1])
+        dates = self.days[first:last].astype('datetime64[D]')
+        counts = pd.Series(self.counts[first:last], index=pd.DatetimeIndex(dates, name='date'), name=name)
+        return counts.asfreq('D', fill_value=0)
+
+
+def burstScores(daily, window=365, min_reports=3, prior=1.0):
+    """Score each day with at least min_reports reports for a city (or
+    state) against the reports there over the window days before it.
+    The expected number of reports on a day is (reports in the window +
+    prior)/window, so places with no history still have a small rate. The
+    score is the Poisson log likelihood ratio of the day's reports against
+    that rate (0 if no more than expected): the higher, the less likely it
+    is to be a chance cluster.
+    Returns a DataFrame of name, date, reports, expected and score."""
+    first_day, last_day = daily.dayRange()
+    # Each row gets a stretch of integer keys, padded at the start so a
+    # window before its first day can't reach into the row before it
+    stride = last_day - first_day + window
+    keys = daily.rows*stride + (daily.days - first_day + window)
+    totals = np.concatenate([[0], np.cumsum(daily.counts)])
+    scored = np.flatnonzero(daily.counts >= min_reports)
+    before = totals[np.searchsorted(keys, keys[scored], side='left')]
+    window_start = totals[np.searchsorted(keys, keys[scored] - window, side='left')]
+    reports = daily.counts[scored].astype(np.float64)
+    expected = (before - window_start + prior)/window
+    scores = np.where(reports > expected, reports*np.log(reports/expected) - (reports - expected), 0.0)
+    return pd.DataFrame({
+        'name': daily.names.to_numpy(dtype=object)[daily.rows[scored]],
+        'date': daily.days[scored].astype('datetime64[D]').astype('datetime64[s]'),
+        'reports': daily.counts[scored],
+        'expected': expected,
+        'score': scores,
+    })
+
+
+def flapEvents(scores, min_score=20.0, max_gap=3):
+    """Candidate flaps: the days of burstScores scoring at least min_score,
+    where days of the same city (or state) no more than max_gap days apart
+    make up one event. Returns a DataFrame of name, start and end date,
+    number of days, reports and the peak and total scores of each event,
+    highest total score first."""
+    flagged = scores[scores['score'] >= min_score].sort_values(['name', 'date'], kind='stable')
+    names = flagged['name'].to_numpy()
+    days = flagged['date'].to_numpy(dtype='datetime64[D]').view(np.int64)
+    new_event = np.ones(len(flagged), dtype=bool)
+    new_event[1:] = (names[1:] != names[:-1]) | (np.diff(days) > max_gap)
+    events = flagged.groupby(np.cumsum(new_event)).agg(
+        name=('name', 'first'), start=('date', 'min'), end=('date', 'max'), days=('date', 'size'),
+        reports=('reports', 'sum'), peak_score=('score', 'max'), score=('score', 'sum'))
+    return events.sort_values('score', ascending=False, kind='stable').reset_index(drop=True)
+
+
+###########################################
+# End of ufo_bursts.py
+###########################################
@@ -0,0 +1,147 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: ufo_cities.py
+# Author: Ra Inta
+# Description: Cleaning and normalization of the free-text city names in the
+# UFO reports. The rules are the ones worked out step by step in
+# ufo_analysis.py, compiled once here and applied as vectorized string
+# operations. There are only ~20,000 distinct city strings among the
+# ~116,000 reports, so each distinct name is cleaned just once and the
+# result mapped back onto every row.
+#
+###########################################
+
+import re
+
+import numpy as np
+import pandas as pd
+
+# Each rule is a regex substitution, applied to the title-cased name (so
+# 'AmArillo' becomes 'Amarillo'), in order:
+city_rules = [
+    # Commentary in parentheses, e.g. 'Henderson (Las Vegas)':
+    (re.compile(r" \(.*", re.S), ""),
+    # ...including any stragglers with '{'s, or no space before the '(':
+    (re.compile(r"\s*[\(\{].*", re.S), ""),
+    # Locations between population centers; the larger one is usually on the
+    # left of the slash or ampersand:
+    (re.compile(r"\s*/.*"), ""),
+    (re.compile(r"\s*&.*"), ""),
+    (re.compile(r"^[Bb]etween"), ","),
+]
+
+
+def cleanCityNames(cities):
+    """Apply city_rules to a Series of (non-null) city names."""
+    cities = cities.astype(object)  # Python (not pyarrow) regex semantics
+    for pattern, replacement in city_rules:
+        cities = cities.str.title().str.replace(pattern, replacement, regex=True)
+    return cities
+
+
+def normalizeCities(cities):
+    """Clean a Series of city names, such as ufo_df['city']. Each distinct name
+    is cleaned once, and the results are mapped back onto the rows (keeping
+    the index). Missing cities stay missing."""
+    codes, uniques = pd.factorize(cities)
+    cleaned = cleanCityNames(pd.Series(uniques)).to_numpy(dtype=object)
+    normalized = np.full(len(codes), np.nan, dtype=object)
+    found = codes >= 0
+    normalized[found] = cleaned[codes[found]]
+    return pd.Series(normalized, index=cities.index, name=cities.name, dtype=object)
+
+
+# Variants of the big cities, e.g. 'North Las Vegas' or 'Washington D.C.',
+# are folded into the city itself by stripping the directions (wherever they
+# are in the name, as ufo_analysis.py always has) and then a suffix for the
+# city, county etc.:
+direction_list = ["North", "N.", "East", "E.", "South", "S.", "West", "W."]
+direction_regex = re.compile("(?:" + "|".join(re.escape(x) for x in direction_list) + ") ")
+suffix_list = ["City", "County", "Area", "Bay", "Airport", "D.C.", "Dc", ","]
+suffix_regex = re.compile(" (?:" + "|".join(re.escape(x) for x in suffix_list) + ")$")
+
+
+def purgeCityModifiers(cities, city_names):
+    """Strip the directions and the city, county etc. suffixes from
+    those names in the Series cities that contain one of city_names (e.g.
+    'Las Vegas'), leaving all other names alone. Each distinct name is
+    checked against a single alternation of city_names, and only the
+    matching ones are rewritten. Returns the new Series and the number of
+    rows that changed."""
+    codes, uniques = pd.factorize(cities)
+    uniques = pd.Series(uniques, dtype=object)
+    city_regex = re.compile("|".join(re.escape(x) for x in city_names))
+    matches = uniques.str.contains(city_regex).to_numpy(dtype=bool)
+    cleaned = uniques.to_numpy(dtype=object, copy=True)
+    cleaned[matches] = (uniques[matches].str.replace(direction_regex, "", regex=True)
+                        .str.replace(suffix_regex, "", regex=True).to_numpy(dtype=object))
+    changed = cleaned != uniques.to_numpy(dtype=object)
+    found = codes >= 0
+    purged = cities.to_numpy(dtype=object, copy=True)
+    purged[found] = cleaned[codes[found]]
+    return (pd.Series(purged, index=cities.index, name=cities.name, dtype=object),
+            int(changed[codes[found]].sum()))
+
+
+class CityIndex(object):
+    """Find the city names containing a given name (e.g. 'Chicago' gives
+    'Chicago', 'West Chicago', 'Chicago Heights'...), along with how many
+    reports each has. Built once from a Series of city names with a single
+    value_counts, plus an inverted index from each three-letter substring
+    (trigram) to the distinct names containing it. A lookup only checks the
+    few names sharing every trigram of the query, so it takes microseconds
+    rather than a scan of every report.
+    Matching is by plain (case-sensitive) substring, rather than the regex
+    of str.contains, so 'St. Louis' only matches a literal '.'.
+    Rebuild the index if the city names change."""
+
+    n = 3
+
+    def __init__(self, cities):
+        counts = cities.value_counts()
+        self.names = counts.index.to_numpy(dtype=object)
+        self.counts = counts.to_numpy()
+        postings = {}
+        for name_id, name in enumerate(self.names):
+            for gram in self.grams(name):
+                postings.setdefault(gram, []).append(name_id)
+        self.postings = dict((gram, set(ids)) for gram, ids in postings.items())
+
+    def grams(self, name):
+        return set(name[i:i + self.n] for i in range(len(name) - self.n + 1))
+
+    def matchIds(self, city_name):
+        """Ids of the distinct names containing city_name, most reports first."""
+        grams = self.grams(city_name)
+        if grams:
+            postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set.intersection(*postings)
+        else:
+            # Too short for a trigram: check every name
+            candidates = range(len(self.names))
+        # value_counts already has the most reported names first
+        return sorted(name_id for name_id in candidates if city_name in self.names[name_id])
+
+    def similar(self, city_name):
+        """DataFrame of the names containing city_name ('city') and their
+        number of reports ('count'), most reports first."""
+        name_ids = self.matchIds(city_name)
+        return pd.DataFrame({'city': self.names[name_ids], 'count': self.counts[name_ids]})
+
+    def similarMany(self, city_names):
+        """similar() for each of city_names in one DataFrame, with the name
+        that was looked up in a 'query' column."""
+        queries, name_ids = [], []
+        for city_name in city_names:
+            matches = self.matchIds(city_name)
+            queries.extend([city_name]*len(matches))
+            name_ids.extend(matches)
+        return pd.DataFrame({'query': queries, 'city': self.names[name_ids],
+                             'count': self.counts[name_ids]})
+
+
+###########################################
+# End of ufo_cities.py
+###########################################
@@ -0,0 +1,231 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: ufo_cube.py
+# Author: Ra Inta
+# Description: A precomputed 'cube' of the number of UFO reports for each
+# combination of year, month, state, shape and city. Most of the charts in
+# ufo_analysis.py are a count over one or two of these, which the cube
+# answers by summing a few thousand cells, rather than re-grouping every
+# report.
+# The cube is saved next to the data (ufo_cube.pkl), and only rebuilt when
+# the data changes. With the spider's columnar dataset (see ufo_data.py),
+# only the months the spider has (re)written since are re-counted.
+#
+# For example:
+# cube = loadCube()
+# cube.counts('year')                        # reports per year
+# cube.counts('month', years=(2007, None))   # per month, from 2007 on
+# cube.counts('city').nlargest(10)
+#
+###########################################
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from ufo_cities import normalizeCities
+from ufo_data import csv_filename, dataset_dir, readReportsDataset
+
+cube_filename = "ufo_cube.pkl"
+
+dimensions = ['year', 'month', 'state', 'shape', 'city']
+# The dimensions stored as ids into a list of names
+named_dimensions = ['state', 'shape', 'city']
+
+
+class ReportCube(object):
+    """The number of reports ('count') in each cell of year, month, state,
+    shape and city. State, shape and city are stored as ids into
+    self.names[dimension] (for cities, the names as cleaned by
+    normalizeCities), with -1 for missing.
+    Each count asked for is remembered until the cube next changes.
+    sources records what the cube was counted from, so loadCube can tell
+    when it's out of date."""
+
+    def __init__(self, cells=None, names=None, sources=None):
+        if cells is None:
+            cells = pd.DataFrame(dict((column, pd.Series(dtype=dtype)) for column, dtype in [
+                ('year', np.int16), ('month', np.int8), ('state_id', np.int32),
+                ('shape_id', np.int32), ('city_id', np.int32), ('count', np.int32)]))
+        self.cells = cells
+        self.names = names if names is not None else dict(
+            (dimension, pd.Index([], dtype=object)) for dimension in named_dimensions)
+        self.sources = sources if sources is not None else {}
+        self.memo = {}
+
+    @classmethod
+    def fromReports(cls, ufo_df):
+        cube = cls()
+        cube.update(ufo_df)
+        return cube
+
+    def ids(self, dimension, values):
+        """Ids of the values of a named dimension, adding any new names.
+        Missing values are -1."""
+        values = pd.Series(values.to_numpy(dtype=object))
+        new = pd.Index(values.dropna().unique(), dtype=object).difference(self.names[dimension])
+        if len(new):
+            self.names[dimension] = self.names[dimension].append(new)
+        return self.names[dimension].get_indexer(values).astype(np.int32)
+
+    def update(self, ufo_df):
+        """Count the reports in ufo_df into the cube. Each month in ufo_df
+        replaces whatever the cube had for that month, just as the spider
+        rewrites a whole month at a time."""
+        new_cells = pd.DataFrame({
+            'year': ufo_df['year'].astype(np.int16).to_numpy(),
+            'month': ufo_df['month'].astype(np.int8).to_numpy(),
+            'state_id': self.ids('state', ufo_df['state']),
+            'shape_id': self.ids('shape', ufo_df['shape']),
+            'city_id': self.ids('city', normalizeCities(ufo_df['city'])),
+        })
+        new_cells = new_cells.groupby(list(new_cells.columns)).size().rename('count').astype(np.int32).reset_index()
+        self.dropMonths(zip(new_cells['year'], new_cells['month']))
+        self.cells = pd.concat([self.cells, new_cells], ignore_index=True)
+
+    def dropMonths(self, months):
+        """Remove the (year, month)s in months from the cube."""
+        months = pd.MultiIndex.from_tuples(set(months), names=['year', 'month'])
+        if len(months):
+            in_months = pd.MultiIndex.from_arrays([self.cells['year'], self.cells['month']]).isin(months)
+            self.cells = self.cells[~in_months]
+        self.memo = {}
+
+    def labels(self, dimension, keys):
+        """The values of a dimension, from the keys in the cells."""
+        if dimension in named_dimensions:
+            return pd.Index(np.append(self.names[dimension].to_numpy(dtype=object), np.nan)[keys],
+                            name=dimension)
+        return pd.Index(keys, name=dimension)
+
+    def counts(self, by, years=None, months=None, dropna=True):
+        """Number of reports by one or more of year, month, state, shape and
+        city, like ufo_df.groupby(by)['posted'].count().
+        years: (first, last) inclusive range of years to count; either can be
+        None for no limit.
+        months: list of months (1-12) to count.
+        dropna: leave out the reports with a missing state, shape or city."""
+        by = (by,) if isinstance(by, str) else tuple(by)
+        key = (by, years, tuple(months) if months is not None else None, dropna)
+        if key not in self.memo:
+            self.memo[key] = self.countCells(by, years, months, dropna)
+        return self.memo[key].copy()
+
+    def countCells(self, by, years, months, dropna):
+        cells = self.cells
+        if years is not None:
+            first, last = years
+            cells = cells[cells['year'].between(first if first is not None else -np.inf,
+                                                last if last is not None else np.inf)]
+        if months is not None:
+            cells = cells[cells['month'].isin(list(months))]
+        columns = [dimension + '_id' if dimension in named_dimensions else dimension for dimension in by]
+        if len(by) == 1:
+            # The keys are small integers, so can be counted straight into bins
+            keys = cells[columns[0]].to_numpy(dtype=np.int64)
+            weights = cells['count'].to_numpy()
+            if dropna:
+                weights = np.where(keys >= 0, weights, 0)
+            offset = keys.min() if len(keys) else 0
+            totals = np.bincount(keys - offset, weights=weights)
+            found = np.flatnonzero(totals)
+            counts = pd.Series(totals[found].astype(np.int64), index=self.labels(by[0], found + offset))
+        else:
+            named = [column for column in columns if column.endswith('_id')]
+            if dropna and named:
+                cells = cells[(cells[named] >= 0).all(axis=1)]
+            counts = cells.groupby(columns)['count'].sum().astype(np.int64)
+            counts.index = pd.MultiIndex.from_arrays(
+                [self.labels(dimension, counts.index.get_level_values(column))
+                 for dimension, column in zip(by, columns)])
+        return counts.sort_index().rename('count')
+
+    def save(self, path=cube_filename):
+        # Write to a temporary file first, so a crash can't leave a
+        # half-written cube behind
+        tmp_path = path + '.tmp'
+        pd.to_pickle({'cells': self.cells, 'names': self.names, 'sources': self.sources}, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=cube_filename):
+        saved = pd.read_pickle(path)
+        return cls(saved['cells'], saved['names'], saved['sources'])
+
+
+def partitionTimes(path=dataset_dir):
+    """Modification time of each month's partition of the columnar dataset,
+    keyed by (year, month)."""
+    times = {}
+    for filename in glob.glob(os.path.join(path, 'year=*', 'month=*', 'part-0.parquet')):
+        year_dir, month_dir = os.path.relpath(os.path.dirname(filename), path).split(os.sep)
+        month = (int(year_dir.split('=')[1]), int(month_dir.split('=')[1]))
+        times[month] = os.stat(filename).st_mtime_ns
+    return times
+
+
+def loadCube(path=cube_filename, dataset=dataset_dir, csv=csv_filename):
+    """The cube of report counts for the current data, from path if it is up
+    to date, otherwise (re)counted and saved there.
+    If the columnar dataset exists, only the months whose partitions were
+    written (or removed) since the cube was saved are re-counted. Otherwise
+    the cube is counted from the whole CSV again whenever it changes."""
+    cube = ReportCube.load(path) if os.path.exists(path) else None
+    if os.path.isdir(dataset):
+        times = partitionTimes(dataset)
+        columns = ['year', 'month', 'state', 'shape', 'city']
+        if cube is None or 'partitions' not in cube.sources:
+            cube = ReportCube.fromReports(readReportsDataset(dataset, columns=columns))
+        else:
+            saved_times = cube.sources['partitions']
+            changed = [month for month, mtime in times.items() if saved_times.get(month) != mtime]
+            removed = [month for month in saved_times if month not in times]
+            if not changed and not removed:
+                return cube
+            cube.dropMonths(removed)
+            for year, month in changed:
+                cube.update(readReportsDataset(dataset, columns=columns, years=(year, year), months=[month]))
+        cube.sources = {'partitions': times}
+    else:
+        stat = os.stat(csv)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if cube is not None and cube.sources.get('csv') == signature:
+            return cube
+        cube = ReportCube.fromReports(pd.read_csv(csv, usecols=['year', 'month', 'state', 'shape', 'city']))
+        cube.sources = {'csv': signature}
+    cube.save(path)
+    return cube
+
+
+if __name__ == "__main__":
+    # Compare with re-grouping the reports, as in ufo_analysis.py
+    import sys
+    import time
+    ufo_df = pd.read_csv(csv_filename)
+    start = time.time()
+    cube = loadCube()
+    print("Loaded cube of {0} cells in {1:.3f} s".format(len(cube.cells), time.time() - start))
+    for by in ['year', 'shape', 'state', 'city']:
+        start = time.time()
+        grouped = ufo_df.groupby(by)['posted'].count()
+        grouped_time = time.time() - start
+        start = time.time()
+        counts = cube.counts(by)
+        cube_time = time.time() - start
+        start = time.time()
+        cube.counts(by)
+        repeat_time = time.time() - start
+        # (The cube's city names are cleaned, so only the totals agree)
+        if by != 'city' and not grouped.equals(counts.astype(grouped.dtype).rename(grouped.name)):
+            sys.exit("The cube's counts by {0} differ from groupby!".format(by))
+        print("Counts by {0}: groupby {1:.1f} ms, cube {2:.1f} ms ({3:.2f} ms asked again)".format(
+            by, 1000*grouped_time, 1000*cube_time, 1000*repeat_time))
+
+
+###########################################
+# End of ufo_cube.py
+###########################################
@@ -0,0 +1,241 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: ufo_data.py
+# Author: Ra Inta
+# Description: Loaders for the UFO reports harvested by the nuforc spider.
+# The spider writes a CSV (national_ufo_reports.csv) and, if pyarrow is
+# installed, a typed columnar (Parquet) copy partitioned by year and month
+# (national_ufo_reports/year=YYYY/month=M/part-0.parquet). Reading the
+# latter is much faster than parsing the CSV, and only touches the columns
+# and partitions you ask for.
+# Without pyarrow, loadReports() reads the CSV with explicit types, and parses
+# the event times in one vectorized step.
+#
+###########################################
+
+import numpy as np
+import pandas as pd
+
+from ufo_durations import durationCache, durations_filename
+
+# The columnar dataset is optional: it needs the pyarrow library
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+csv_filename = "national_ufo_reports.csv"
+dataset_dir = "national_ufo_reports"
+details_filename = "national_ufo_report_details.csv"
+
+
+def readReportsDataset(path=dataset_dir, columns=None, years=None, months=None):
+    """Read the Parquet copy of the reports into a DataFrame.
+    columns: list of columns to read (default: all). 'year' and 'month' come
+    from the partition paths, as int16.
+    years: (first, last) inclusive range of years to read; partitions
+    outside of it are never opened.
+    months: list of months (1-12) to read.
+    Shape and state come back as categoricals and event_time as datetimes."""
+    if pa is None:
+        raise ImportError("Reading the columnar dataset requires pyarrow")
+    partitioning = ds.partitioning(
+        pa.schema([('year', pa.int16()), ('month', pa.int16())]), flavor='hive')
+    dataset = ds.dataset(path, format='parquet', partitioning=partitioning)
+    row_filter = None
+    if years is not None:
+        row_filter = (ds.field('year') >= years[0]) & (ds.field('year') <= years[1])
+    if months is not None:
+        month_filter = ds.field('month').isin(list(months))
+        row_filter = month_filter if row_filter is None else row_filter & month_filter
+    return dataset.to_table(columns=columns, filter=row_filter).to_pandas()
+
+
+# The CSV columns, and their types. State and shape only have a few dozen
+# distinct values each, so are much smaller as categoricals.
+csv_dtypes = {
+    'date_time': str,
+    'year': np.int16,
+    'month': np.int8,
+    'city': str,
+    'state': 'category',
+    'shape': 'category',
+    'duration': str,
+    'posted': str,
+    'url': str,
+}
+
+# The date_time field as entered: m/d/yy, and (usually) hh:mm
+date_time_regex = r'^\s*\d{1,2}/(\d{1,2})/\d{2,4}(?:\s+(\d{1,2}):(\d{2}))?'
+# Distinct date_times parsed at a time. Nearly every report has a date_time
+# of its own, and the strings extracted from them take far more memory than
+# the numbers they are turned into, so they are only held a chunk at a time.
+date_time_chunk = 10000
+
+
+def eventTimes(year, month, date_time):
+    """The event time of each report, as datetime64[s]. The date_time field
+    only has a two-digit year, so the year and month (the century, in effect)
+    are taken from the year and month of the page URL, and only the day and
+    time from date_time. Whole seconds, rather than pandas' default
+    nanoseconds, reach back before 1678 (Timestamp.min), so the handful of
+    early reports keep their times.
+    There are far fewer distinct date_time strings than reports, so each is
+    parsed just once. Anything that isn't a real date becomes NaT."""
+    codes, uniques = pd.factorize(date_time)
+    parts = [pd.Series(uniques[start:start + date_time_chunk], dtype=object).str.extract(date_time_regex)
+             .apply(pd.to_numeric).to_numpy(dtype=float) for start in range(0, len(uniques), date_time_chunk)]
+    # Missing date_times (code -1) pick up the row of NaNs on the end
+    parts = np.vstack(parts + [np.full((1, 3), np.nan)])[codes]
+    day, hour, minute = parts[:, 0], np.nan_to_num(parts[:, 1]), np.nan_to_num(parts[:, 2])
+    months = (np.asarray(year, dtype=np.int64) - 1970)*12 + np.asarray(month, dtype=np.int64) - 1
+    month_start = months.astype('datetime64[M]')
+    days = np.where(np.isnan(day), 1, day).astype(np.int64) - 1
+    seconds = (days*86400 + hour*3600 + minute*60).astype(np.int64)
+    times = month_start.astype('datetime64[s]') + seconds.astype('timedelta64[s]')
+    # A day beyond the end of the month (e.g. 2/30) would spill over into the next
+    valid = (~np.isnan(day) & (day >= 1) & (hour <= 24) & (minute <= 59)
+             & (times.astype('datetime64[M]') == month_start))
+    times[~valid] = np.datetime64('NaT')
+    return times
+
+
+def loadReports(path=csv_filename, compact=False, durations=durations_filename):
+    """Read the reports CSV with explicit column types (see csv_dtypes), and
+    add the event time of each report ('event_time', see eventTimes) and its
+    day of the month ('day'). The date_time column is left as entered.
+    compact: return the compact form of the table instead (see
+    compactReports, which durations is passed on to)."""
+    ufo_df = pd.read_csv(path, dtype=csv_dtypes)
+    ufo_df['event_time'] = pd.Series(eventTimes(ufo_df['year'], ufo_df['month'], ufo_df['date_time']),
+                                     index=ufo_df.index)
+    if compact:
+        return compactReports(ufo_df, durations)
+    ufo_df['day'] = ufo_df['event_time'].dt.day
+    return ufo_df
+
+
+report_url_prefix = "http://www.nuforc.org/webreports/"
+report_url_regex = r'^' + report_url_prefix.replace('.', r'\.') + r'(\d+)/S(\d+)\.html$'
+
+
+def reportUrls(bucket, report_id):
+    """The report page URLs, from their bucket (directory) and report ID
+    numbers, e.g. 142, 142925 gives
+    http://www.nuforc.org/webreports/142/S142925.html"""
+    return (report_url_prefix + pd.Series(bucket).astype(str).str.zfill(3) + '/S'
+            + pd.Series(report_id).astype(str).str.zfill(5) + '.html')
+
+
+def compactReports(ufo_df, durations=durations_filename):
+    """A compact copy of the reports table, as read by pd.read_csv or
+    loadReports, for holding many decades of reports in memory:
+    - year and month as small integers;
+    - city, state and shape as categoricals;
+    - the URL as its bucket (the directory it is in) and report ID numbers
+      (see reportUrls). If any URL can't be rebuilt from these, it is kept too,
+      as a categorical;
+    - duration as a number of seconds (duration_seconds), and whether that
+      was definite (duration_confident), see ufo_durations.py. The durations
+      parsed so far are read from, and saved to, the durations path (None to
+      keep them in this session only);
+    - posted and event_time as datetimes, rather than the date_time strings;
+    - smartphone_epoch as a boolean: True from 2007 (the iPhone) on."""
+    if 'event_time' in ufo_df:
+        event_time = ufo_df['event_time'].to_numpy()
+    else:
+        event_time = eventTimes(ufo_df['year'], ufo_df['month'], ufo_df['date_time'])
+    cache = durationCache(durations)
+    parsed = cache.parse(ufo_df['duration'])
+    if cache.path:
+        cache.save()
+    compact = pd.DataFrame({
+        'event_time': event_time.astype('datetime64[s]'),
+        'year': ufo_df['year'].astype(np.int16),
+        'month': ufo_df['month'].astype(np.int8),
+        'city': ufo_df['city'].astype('category'),
+        'state': ufo_df['state'].astype('category'),
+        'shape': ufo_df['shape'].astype('category'),
+        'duration_seconds': parsed['seconds'],
+        'duration_confident': parsed['confident'],
+        'posted': pd.to_datetime(ufo_df['posted'], format='%m/%d/%y', errors='coerce').astype('datetime64[s]'),
+    }, index=ufo_df.index)
+    url_parts = ufo_df['url'].str.extract(report_url_regex).apply(pd.to_numeric)
+    if (reportUrls(url_parts[0], url_parts[1]).to_numpy() == ufo_df['url'].to_numpy()).all():
+        compact['bucket'] = url_parts[0].astype(np.int16)
+        compact['report_id'] = url_parts[1].astype(np.int32)
+    else:
+        compact['bucket'] = url_parts[0].astype('Int16')
+        compact['report_id'] = url_parts[1].astype('Int32')
+        compact['url'] = ufo_df['url'].astype('category')
+    compact['smartphone_epoch'] = compact['year'] >= 2007
+    return compact
+
+
+def readReportDetails(path=details_filename, columns=None):
+    """Read the details of each report (the full description etc.), as
+    harvested by the nuforc_reports spider. Join them to the reports on the
+    url, e.g.:
+    ufo_df.merge(readReportDetails(columns=['url', 'description']), on='url', how='left')"""
+    return pd.read_csv(path, usecols=columns, dtype=str)
+
+
+def loadLikeAnalysis(path=csv_filename):
+    """Read the CSV and build the event times the way ufo_analysis.py does."""
+    ufo_df = pd.read_csv(path, parse_dates=[0])
+    ufo_df['date_time'] = pd.to_datetime(ufo_df['date_time'], format='mixed', errors='coerce')
+    ufo_df['day'] = [x.day for x in ufo_df['date_time']]
+    ufo_df['event_time'] = pd.to_datetime(ufo_df[ufo_df['year'] > 1678].loc[:, ['year', 'month', 'day']])
+    return ufo_df
+
+
+def timeLoader(loader):
+    """Seconds taken, growth in peak resident memory (MB) and size (MB) of
+    the DataFrame read by loader. Run in a fresh process, so that the peak is
+    the loader's own."""
+    import resource
+    import time
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024  # kB on Linux
+    start = time.time()
+    ufo_df = loader()
+    elapsed = time.time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 - base_rss
+    return len(ufo_df), elapsed, peak_rss, ufo_df.memory_usage(deep=True).sum()/1e6
+
+
+def sameEventTimes(path=csv_filename, dataset=dataset_dir):
+    """Whether the event times in the columnar dataset (built by the spider's
+    Parquet pipeline) are the same as those loadReports builds from the CSV,
+    report by report (matched on the url)."""
+    from_csv = loadReports(path).drop_duplicates('url').set_index('url')['event_time']
+    from_dataset = readReportsDataset(dataset, columns=['url', 'event_time']).drop_duplicates('url')
+    from_dataset = from_dataset.set_index('url')['event_time'].astype('datetime64[s]')
+    return from_csv.reindex(from_dataset.index).equals(from_dataset)
+
+
+if __name__ == "__main__":
+    # Compare with the way ufo_analysis.py reads the CSV
+    import multiprocessing
+    import os
+    import sys
+    if pa is not None and os.path.isdir(dataset_dir):
+        if not sameEventTimes():
+            sys.exit("The event times in {0} differ from those built from {1}!".format(dataset_dir, csv_filename))
+        print("The event times in {0} match those built from {1}".format(dataset_dir, csv_filename))
+    loaders = [("read_csv, as in ufo_analysis.py", loadLikeAnalysis),
+               ("loadReports", loadReports)]
+    if pa is not None and os.path.isdir(dataset_dir):
+        loaders.append(("readReportsDataset", readReportsDataset))
+    for label, loader in loaders:
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            rows, elapsed, peak_rss, size = pool.apply(timeLoader, (loader,))
+        print("{0}: {1} rows in {2:.3f} s, peak RSS +{3:.0f} MB, {4:.1f} MB in memory".format(
+            label, rows, elapsed, peak_rss, size))
+
+
+###########################################
+# End of ufo_data.py
+###########################################
@@ -0,0 +1,335 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: ufo_dedup.py
+# Author: Ra Inta
+# Description: The same sighting is often listed more than once on NUFORC:
+# several witnesses report it, or it is posted again on a later date. This
+# inflates the counts per city (and per capita). Reports are clustered as
+# duplicates if they share a normalized key of event time (to the hour),
+# city, state and shape. Where the full description is available (see
+# readReportDetails in ufo_data.py), reports in the same state whose text is
+# nearly the same are clustered too. Those are found with MinHash signatures
+# and locality-sensitive hashing (LSH), which only compares reports that
+# land in the same hash bucket, rather than every pair of reports.
+# The keys and signatures are saved (ufo_dedup.pkl), and, as for the cube
+# (ufo_cube.py), only the months the spider has (re)written since are
+# hashed again, e.g.:
+#
+# duplicates = loadDuplicates()
+# ufo_df['cluster_id'] = duplicates.clusterIds(ufo_df['url'])
+# duplicates.dedupe(ufo_df)   # one report per sighting
+#
+###########################################
+
+import os
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from ufo_cities import normalizeCities
+from ufo_cube import partitionTimes
+from ufo_data import csv_filename, dataset_dir, details_filename, eventTimes, readReportDetails, \
+    readReportsDataset
+from ufo_gazetteer import cityKey
+
+dedup_filename = "ufo_dedup.pkl"
+
+# The shingles are hashed by multiply-shift, (a*x + b) >> 32, with fixed a
+# and b so the signatures saved before are still comparable
+minhash_seed = 1947
+# Texts are shingled into runs of three words; shorter texts aren't hashed
+min_shingles = 5
+# The number of (MinHash, shingle) values worked out at once, to limit memory
+minhash_chunk = 1 << 22
+# Odd multipliers for combining word (and band) hashes
+mix_multipliers = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F], dtype=np.uint64)
+
+
+def duplicateKeys(ufo_df, time_unit='h'):
+    """The normalized key of each report: 'time|city|state|shape', where the
+    event time is truncated to time_unit (a numpy unit, e.g. 'h' or 'D'),
+    and the city is cleaned (see normalizeCities and cityKey). Missing
+    (None) without an event time or city.
+    ufo_df needs city, state and shape, and event_time or else year, month
+    and date_time."""
+    if 'event_time' in ufo_df:
+        times = ufo_df['event_time'].to_numpy(dtype='datetime64[s]')
+    else:
+        times = eventTimes(ufo_df['year'], ufo_df['month'], ufo_df['date_time'])
+    codes, uniques = pd.factorize(normalizeCities(ufo_df['city']))
+    city_keys = np.append([cityKey(city) for city in uniques], '')[codes]
+    keys = pd.Series(np.datetime_as_string(times.astype('datetime64[{0}]'.format(time_unit))), dtype=object)
+    states = ufo_df['state'].astype(object).fillna('').str.upper().to_numpy(dtype=object)
+    shapes = ufo_df['shape'].astype(object).fillna('').str.lower().to_numpy(dtype=object)
+    keys = keys + '|' + city_keys + '|' + states + '|' + shapes
+    keys[np.isnat(times) | (city_keys == '')] = None
+    return keys.to_numpy(dtype=object)
+
+
+def shingleHashes(texts):
+    """Hashes (uint64, under 2**32) of each run of three words of each of
+    texts (lower-cased), and the number of them for each text. Each
+    distinct word is only hashed once."""
+    words = [re.findall(r'[a-z0-9]+', text.lower()) if isinstance(text, str) else [] for text in texts]
+    n_words = np.array([len(text_words) for text_words in words], dtype=np.int64)
+    codes, uniques = pd.factorize(pd.Series([word for text_words in words for word in text_words], dtype=object))
+    word_hashes = np.array([zlib.crc32(word.encode()) for word in uniques], dtype=np.uint64)[codes]
+    # A shingle starts at each word with two more words after it in its text
+    n_shingles = np.maximum(n_words - 2, 0)
+    text_starts = np.cumsum(n_words) - n_words
+    starts = np.repeat(text_starts - np.cumsum(n_shingles) + n_shingles, n_shingles) + np.arange(n_shingles.sum())
+    shingles = (word_hashes[starts]*mix_multipliers[0] + word_hashes[starts + 1]*mix_multipliers[1]
+                + word_hashes[starts + 2]) >> np.uint64(32)
+    return shingles, n_shingles
+
+
+def minHashes(texts, n_hashes=64):
+    """MinHash signatures (n_hashes uint32 values each) of each of texts, as
+    a (len(texts), n_hashes) array, and whether each text was long enough to
+    be hashed. The fraction of equal values in two signatures estimates the
+    Jaccard similarity of the texts' shingles."""
+    random = np.random.RandomState(minhash_seed)
+    a = random.randint(0, 1 << 62, size=n_hashes, dtype=np.int64).astype(np.uint64)*np.uint64(2) + np.uint64(1)
+    b = random.randint(0, 1 << 62, size=n_hashes, dtype=np.int64).astype(np.uint64)
+    shingles, n_shingles = shingleHashes(texts)
+    hashed = n_shingles >= min_shingles
+    signatures = np.full((len(n_shingles), n_hashes), np.iinfo(np.uint32).max, dtype=np.uint32)
+    rows = np.repeat(np.arange(len(n_shingles)), n_shingles)
+    shingles, rows = shingles[hashed[rows]], rows[hashed[rows]]
+    # Each chunk covers whole texts, so np.minimum.reduceat can take the
+    # minimum over each text's shingles
+    starts = np.flatnonzero(np.diff(np.append(-1, rows)))
+    step = max(1, minhash_chunk // n_hashes)
+    first = 0
+    while first < len(starts):
+        last = max(np.searchsorted(starts, starts[first] + step, side='left'), first + 1)
+        stop = starts[last] if last < len(starts) else len(rows)
+        chunk = ((shingles[starts[first]:stop, None]*a + b) >> np.uint64(32)).astype(np.uint32)
+        signatures[rows[starts[first:last]]] = np.minimum.reduceat(chunk, starts[first:last] - starts[first])
+        first = last
+    return signatures, hashed
+
+
+def firstRows(index, values):
+    """The position in index of the first occurrence of each of values, or
+    -1 if it isn't there (get_indexer, allowing repeats in index)."""
+    first = ~index.duplicated()
+    return np.append(np.flatnonzero(first), -1)[index[first].get_indexer(values)]
+
+
+def linkClusters(n, first, second):
+    """Cluster id (the smallest row in the cluster) of each of n rows, where
+    rows first[i] and second[i] are in the same cluster."""
+    labels = np.arange(n)
+    while True:
+        lowest = np.minimum(labels[first], labels[second])
+        linked = labels.copy()
+        np.minimum.at(linked, first, lowest)
+        np.minimum.at(linked, second, lowest)
+        linked = linked[linked]
+        if np.array_equal(linked, labels):
+            return labels
+        labels = linked
+
+
+class DuplicateClusters(object):
+    """The duplicate key (see duplicateKeys) and text MinHash signature of
+    each report, by url, from which the reports are clustered.
+    Reports with the same key are duplicates. So are reports in the same
+    state whose signatures agree on at least threshold of their values. Only
+    reports sharing a bucket in one of the LSH bands (n_hashes/bands values
+    each) are compared, each against the first report in the bucket.
+    The clusters are remembered until the reports next change."""
+
+    def __init__(self, reports=None, signatures=None, sources=None, time_unit='h', threshold=0.8,
+                 n_hashes=64, bands=16):
+        if reports is None:
+            reports = pd.DataFrame(dict((column, pd.Series(dtype=dtype)) for column, dtype in [
+                ('url', object), ('year', np.int16), ('month', np.int8), ('key', object),
+                ('state', object), ('text_hash', np.int64), ('hashed', bool)]))
+            signatures = np.zeros((0, n_hashes), dtype=np.uint32)
+        self.reports = reports
+        self.signatures = signatures
+        self.sources = sources if sources is not None else {}
+        self.time_unit = time_unit
+        self.threshold = threshold
+        self.n_hashes = n_hashes
+        self.bands = bands
+        self.labels = None
+
+    def update(self, ufo_df, text_column='description'):
+        """Add the reports of ufo_df (with url, year, month, city, state, shape
+        and the event time, see duplicateKeys), replacing whatever there was
+        for those months. The text of a report (text_column, if ufo_df has
+        it) is only hashed again if it has changed."""
+        texts = ufo_df[text_column] if text_column in ufo_df else pd.Series(np.nan, index=ufo_df.index)
+        text_hashes = np.array([zlib.crc32(text.encode()) if isinstance(text, str) else -1 for text in texts],
+                               dtype=np.int64)
+        new_reports = pd.DataFrame({
+            'url': ufo_df['url'].to_numpy(dtype=object),
+            'year': ufo_df['year'].astype(np.int16).to_numpy(),
+            'month': ufo_df['month'].astype(np.int8).to_numpy(),
+            'key': duplicateKeys(ufo_df, self.time_unit),
+            'state': ufo_df['state'].to_numpy(dtype=object),
+            'text_hash': text_hashes,
+        })
+        # Reuse the signatures of the reports whose text hasn't changed
+        old = firstRows(pd.MultiIndex.from_arrays([self.reports['url'], self.reports['text_hash']]),
+                        pd.MultiIndex.from_arrays([new_reports['url'], new_reports['text_hash']]))
+        signatures = np.zeros((len(new_reports), self.n_hashes), dtype=np.uint32)
+        hashed = np.zeros(len(new_reports), dtype=bool)
+        signatures[old >= 0] = self.signatures[old[old >= 0]]
+        hashed[old >= 0] = self.reports['hashed'].to_numpy()[old[old >= 0]]
+        new = np.flatnonzero(old < 0)
+        signatures[new], hashed[new] = minHashes(texts.to_numpy(dtype=object)[new], self.n_hashes)
+        new_reports['hashed'] = hashed
+        self.dropMonths(zip(new_reports['year'], new_reports['month']))
+        reports = pd.concat([self.reports, new_reports], ignore_index=True)
+        signatures = np.vstack([self.signatures, signatures])
+        # Kept in order, so the cluster ids don't depend on the order of updates
+        order = np.lexsort((reports['url'].to_numpy(dtype=str), reports['month'], reports['year']))
+        self.reports = reports.take(order).reset_index(drop=True)
+        self.signatures = signatures[order]
+
+    def dropMonths(self, months):
+        """Remove the reports of the (year, month)s in months."""
+        months = pd.MultiIndex.from_tuples(set(months), names=['year', 'month'])
+        if len(months):
+            kept = ~pd.MultiIndex.from_arrays([self.reports['year'], self.reports['month']]).isin(months)
+            self.reports = self.reports[kept].reset_index(drop=True)
+            self.signatures = self.signatures[kept]
+        self.labels = None
+
+    def keyPairs(self):
+        """Rows with the same key, each paired with the first of them."""
+        codes = pd.factorize(self.reports['key'])[0]
+        rows = np.flatnonzero(codes >= 0)
+        firsts = np.full(codes.max() + 1 if len(rows) else 0, len(codes))
+        np.minimum.at(firsts, codes[rows], rows)
+        return rows, firsts[codes[rows]]
+
+    def textPairs(self):
+        """Rows with nearly the same text in the same state, each paired with
+        the first row sharing one of its LSH buckets."""
+        rows = np.flatnonzero(self.reports['hashed'].to_numpy())
+        states = pd.factorize(self.reports['state'].to_numpy(dtype=object)[rows])[0].astype(np.uint64)
+        band_width = self.n_hashes // self.bands
+        firsts, seconds = [], []
+        for band in range(self.bands):
+            # A bucket is a state and the values of the band, hashed together
+            # (a collision only makes a pair to compare, which won't match)
+            buckets = states.copy()
+            for column in range(band*band_width, (band + 1)*band_width):
+                buckets = buckets*mix_multipliers[0] + self.signatures[rows, column]
+            codes = pd.factorize(buckets)[0]
+            first_rows = np.full(codes.max() + 1 if len(codes) else 0, len(rows))
+            np.minimum.at(first_rows, codes, np.arange(len(rows)))
+            first_rows = first_rows[codes]
+            candidates = np.flatnonzero(first_rows != np.arange(len(rows)))
+            agreement = (self.signatures[rows[candidates]]
+                         == self.signatures[rows[first_rows[candidates]]]).mean(axis=1)
+            similar = candidates[agreement >= self.threshold]
+            firsts.append(rows[similar])
+            seconds.append(rows[first_rows[similar]])
+        return np.concatenate(firsts + [[]]).astype(np.int64), np.concatenate(seconds + [[]]).astype(np.int64)
+
+    def clusters(self):
+        """The cluster id of each report in self.reports: the row of the
+        first report (by year, month and url) in its cluster."""
+        if self.labels is None:
+            key_rows, key_firsts = self.keyPairs()
+            text_rows, text_firsts = self.textPairs()
+            self.labels = linkClusters(len(self.reports), np.concatenate([key_rows, text_rows]),
+                                       np.concatenate([key_firsts, text_firsts]))
+        return self.labels
+
+    def clusterIds(self, urls):
+        """The cluster id of each of a Series of report urls (-1 if unknown)."""
+        rows = firstRows(pd.Index(self.reports['url']), urls)
+        ids = np.append(self.clusters(), -1)[rows]
+        return pd.Series(ids, index=urls.index, name='cluster_id')
+
+    def dedupe(self, ufo_df):
+        """One report per cluster from ufo_df (the first, in the order of
+        ufo_df), with the number of reports of that sighting in ufo_df
+        ('listings'). Reports unknown to the clusters are kept as they are."""
+        ids = self.clusterIds(ufo_df['url']).to_numpy()
+        ids = np.where(ids >= 0, ids, -1 - np.arange(len(ids)))
+        listings = pd.Series(ids).map(pd.Series(ids).value_counts()).to_numpy()
+        first = ~pd.Series(ids).duplicated().to_numpy()
+        return ufo_df[first].assign(listings=listings[first])
+
+    def save(self, path=dedup_filename):
+        # Write to a temporary file first, so a crash can't leave a
+        # half-written file behind
+        tmp_path = path + '.tmp'
+        pd.to_pickle({'reports': self.reports, 'signatures': self.signatures, 'sources': self.sources,
+                      'settings': (self.time_unit, self.threshold, self.n_hashes, self.bands)}, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=dedup_filename):
+        saved = pd.read_pickle(path)
+        time_unit, threshold, n_hashes, bands = saved['settings']
+        return cls(saved['reports'], saved['signatures'], saved['sources'], time_unit, threshold, n_hashes, bands)
+
+
+def fileSignature(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def loadDuplicates(path=dedup_filename, dataset=dataset_dir, csv=csv_filename, details=details_filename):
+    """The duplicate clusters for the current data, from path if up to date,
+    otherwise updated and saved there. With the columnar dataset, only the
+    months whose partitions were written (or removed) since are updated;
+    otherwise the whole CSV is, whenever it changes. Either way, only
+    reports that are new, or whose description (from details, if it
+    exists) has changed, are hashed again."""
+    clusters = DuplicateClusters.load(path) if os.path.exists(path) else DuplicateClusters()
+    columns = ['url', 'year', 'month', 'city', 'state', 'shape', 'event_time']
+    details_signature = fileSignature(details)
+    new_details = clusters.sources.get('details') != details_signature
+    if os.path.isdir(dataset):
+        times = partitionTimes(dataset)
+        saved_times = clusters.sources.get('partitions', {})
+        changed = [month for month, mtime in times.items() if new_details or saved_times.get(month) != mtime]
+        removed = [month for month in saved_times if month not in times]
+        if not changed and not removed:
+            return clusters
+        clusters.dropMonths(removed)
+        years = (min(year for year, month in changed), max(year for year, month in changed)) if changed else None
+        reports = readReportsDataset(dataset, columns=columns, years=years) if changed else None
+        if reports is not None:
+            changed = pd.MultiIndex.from_tuples(changed)
+            reports = reports[pd.MultiIndex.from_arrays([reports['year'], reports['month']]).isin(changed)]
+        sources = {'partitions': times}
+    else:
+        signature = fileSignature(csv)
+        if clusters.sources.get('csv') == signature and not new_details:
+            return clusters
+        reports = pd.read_csv(csv, usecols=['url', 'year', 'month', 'city', 'state', 'shape', 'date_time'])
+        clusters.dropMonths(set(zip(clusters.reports['year'], clusters.reports['month']))
+                            - set(zip(reports['year'], reports['month'])))
+        sources = {'csv': signature}
+    if reports is not None:
+        if details_signature is not None:
+            descriptions = readReportDetails(details, columns=['url', 'description'])
+            # (The latest, if a report was harvested twice)
+            descriptions = descriptions.drop_duplicates('url', keep='last')
+            reports = reports.merge(descriptions, on='url', how='left')
+        clusters.update(reports)
+    clusters.sources = dict(sources, details=details_signature)
+    clusters.save(path)
+    return clusters
+
+
+###########################################
+# End of ufo_dedup.py
+###########################################
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: ufo_durations.py
+# Author: Ra Inta
+# Description: Parsing the free-text durations of the UFO reports (e.g.
+# '5 minutes', '2-3 min', 'approx 1 hr', 'a few seconds', '1 min. 30 sec.')
+# into numbers of seconds, along with a flag for whether the witness gave a
+# definite duration. Clock-style durations ('1:30') could be minutes and
+# seconds or hours and minutes, so aren't parsed (they come out as NaN).
+# As with the city names (see ufo_cities.py), there are far
+# fewer distinct durations (~30,000) than reports, so each distinct one is
+# parsed just once, with compiled regexes applied as vectorized string
+# operations, and remembered (see DurationCache) so that later loads only
+# parse the durations they haven't seen before. compactReports (in
+# ufo_data.py) also saves them (ufo_durations.pkl) for the next session;
+# they are saved along with parser_version, and parsed afresh if it changes.
+#
+###########################################
+
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+durations_filename = "ufo_durations.pkl"
+# Change this whenever parseDurationStrings would parse anything differently,
+# so the durations saved by an older version are parsed again
+parser_version = 2
+
+# Seconds in each unit, keyed by how the unit starts
+unit_seconds = {
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400,
+    'w': 604800,
+}
+
+# Numbers that are written out
+number_words = {
+    'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11,
+    'twelve': 12, 'fifteen': 15, 'twenty': 20, 'thirty': 30, 'forty': 40,
+    'forty-five': 45, 'fifty': 50, 'sixty': 60, 'ninety': 90, 'half': 0.5,
+    'a half': 0.5, 'a couple': 2, 'a couple of': 2, 'couple': 2,
+    'couple of': 2, 'a few': 3, 'few': 3, 'several': 5,
+}
+# ...of which these are guesses
+vague_words = {'a couple', 'a couple of', 'couple', 'couple of', 'a few', 'few', 'several'}
+
+# Longest first, so that e.g. 'forty-five' isn't taken as 'forty'
+number_word_regex = '|'.join(re.escape(word).replace(r'\ ', r'\s+')
+                             for word in sorted(number_words, key=len, reverse=True))
+number_regex = r'\d+(?:\.\d+)?(?:\s+\d+/\d+)?|\d+/\d+|\.\d+|' + number_word_regex
+unit_regex = r'sec(?:ond)?s?|s|min(?:ute)?s?|m|hours?|hrs?|h|days?|d|weeks?|wks?|w'
+
+# A number, or a range of numbers (e.g. '2-3', '2 to 3', '2 or 3'), followed by
+# a unit, e.g. '5 minutes', '1.5hrs', '2-3 min', 'half an hour'. A range can
+# also run from one unit to another, e.g. '30 sec.-1 min.', '1 min to 1 hour':
+duration_regex = re.compile(
+    r'(?<![\w.])(?P<low>' + number_regex + r')\+?'
+    r'(?:\s*(?:-|to|or)\s*(?P<high>' + number_regex + r')\+?)?'
+    r'[\s-]*(?:an?\s+)?(?P<unit>' + unit_regex + r')\.?(?![a-z])'
+    r'(?:\s*(?:-|to)\s*(?P<end>' + number_regex + r')\+?'
+    r'[\s-]*(?:an?\s+)?(?P<end_unit>' + unit_regex + r')\.?(?![a-z]))?', re.I)
+# A number split into its whole part and fraction, e.g. '5 1/2'
+number_parts_regex = re.compile(r'^(\d*(?:\.\d+)?)\s*(?:(\d+)/(\d+))?$')
+# Witnesses hedging their bets (as whole words, so 'hovering' isn't 'over')
+approximate_regex = re.compile(r'\b(?:approx\w*|apprx|appr|about|around|roughly|maybe|est(?:imated?)?|'
+                               r'less than|more than|over|under|at least|almost|nearly|or so|or more|'
+                               r'or less|or longer|give or take|plus or minus|ish)\b|(?<=\d)ish\b|'
+                               r'[~<>?+]', re.I)
+
+
+def numberValues(numbers):
+    """The values of a Series of numbers as matched by number_regex. The same
+    few numbers come up again and again, so each is only parsed once."""
+    codes, uniques = pd.factorize(numbers)
+    uniques = pd.Series(uniques, dtype=object).str.lower().str.replace(r'\s+', ' ', regex=True)
+    parts = uniques.str.extract(number_parts_regex)
+    whole = pd.to_numeric(parts[0].replace('', np.nan), errors='coerce')
+    fraction = pd.to_numeric(parts[1], errors='coerce')/pd.to_numeric(parts[2], errors='coerce')
+    values = whole.fillna(0) + fraction.fillna(0)
+    values[whole.isna() & fraction.isna()] = np.nan
+    values = values.fillna(uniques.map(number_words)).to_numpy(dtype=float)
+    return pd.Series(np.append(values, np.nan)[codes], index=numbers.index)
+
+
+def parseDurationStrings(durations):
+    """Parse a Series of distinct (non-null) duration strings into a
+    DataFrame with the same index, of:
+    - seconds: the total of every number and unit in the string (so
+      '1 min. 30 sec.' is 90), taking the middle of any range (so
+      '30 sec.-1 min.' is 45). NaN if there isn't any;
+    - confident: whether the witness gave a definite duration, rather than a
+      range ('2-3 min'), a hedge ('approx 1 hr', '5 min or so') or a guess
+      ('a few seconds')."""
+    durations = durations.astype(object)  # Python (not pyarrow) regex semantics
+    terms = durations.str.extractall(duration_regex)
+    low = numberValues(terms['low'])
+    high = numberValues(terms['high'].dropna()).reindex(terms.index)
+    seconds = high.add(low).div(2).fillna(low)*terms['unit'].str[0].str.lower().map(unit_seconds)
+    # A range from one unit to another, e.g. '30 sec.-1 min.'
+    end = numberValues(terms['end'].dropna()).reindex(terms.index)
+    end_seconds = end*terms['end_unit'].str[0].str.lower().map(unit_seconds)
+    seconds = seconds.add(end_seconds).div(2).fillna(seconds)
+    guessed = terms['low'].str.lower().str.replace(r'\s+', ' ', regex=True).isin(vague_words)
+    ranges = terms['high'].notna() | terms['end'].notna()
+    by_string = pd.DataFrame({'seconds': seconds, 'vague': ranges | guessed}).groupby(level=0)
+    parsed = pd.DataFrame({'seconds': by_string['seconds'].sum(min_count=1),
+                           'vague': by_string['vague'].any()}).reindex(durations.index)
+    confident = (parsed['seconds'].notna() & ~parsed['vague'].fillna(True).astype(bool)
+                 & ~durations.str.contains(approximate_regex))
+    return pd.DataFrame({'seconds': parsed['seconds'].astype(np.float32),
+                         'confident': confident.astype(bool)}, index=durations.index)
+
+
+class DurationCache(object):
+    """The parsed durations seen so far (a DataFrame indexed by the duration
+    strings, see parseDurationStrings), so that each is only parsed once.
+    If path is given, the cache is read from there (unless it was saved by
+    another parser_version), and save() writes it back for the next time."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.parsed = pd.DataFrame({'seconds': pd.Series(dtype=np.float32),
+                                    'confident': pd.Series(dtype=bool)},
+                                   index=pd.Index([], dtype=object))
+        if path and os.path.exists(path):
+            saved = pd.read_pickle(path)
+            if isinstance(saved, dict) and saved.get('version') == parser_version:
+                self.parsed = saved['parsed']
+        self.n_saved = len(self.parsed)
+
+    def parse(self, durations):
+        """Parsed durations (seconds, confident) for each of a Series of
+        duration strings, with the same index. Missing durations are NaN, and
+        not confident."""
+        codes, uniques = pd.factorize(durations)
+        uniques = pd.Index(uniques, dtype=object)
+        new = uniques[~uniques.isin(self.parsed.index)]
+        if len(new):
+            self.parsed = pd.concat([self.parsed, parseDurationStrings(pd.Series(new, index=new))])
+        parsed = self.parsed.reindex(uniques)
+        # Missing durations (code -1) pick up the values on the end
+        seconds = np.append(parsed['seconds'].to_numpy(dtype=np.float32), np.float32(np.nan))[codes]
+        confident = np.append(parsed['confident'].to_numpy(dtype=bool), False)[codes]
+        return pd.DataFrame({'seconds': seconds, 'confident': confident}, index=durations.index)
+
+    def save(self):
+        if len(self.parsed) == self.n_saved and os.path.exists(self.path):
+            return
+        # Write to a temporary file first, so a crash can't leave a
+        # half-written cache behind
+        tmp_path = self.path + '.tmp'
+        pd.to_pickle({'version': parser_version, 'parsed': self.parsed}, tmp_path)
+        os.replace(tmp_path, self.path)
+        self.n_saved = len(self.parsed)
+
+
+# Shared by everything in this session, by the path they are saved to (None
+# for those that aren't), see durationCache
+duration_caches = {None: DurationCache()}
+duration_cache = duration_caches[None]
+
+
+def durationCache(path=None):
+    """The DurationCache shared by everything in this session that saves
+    its durations to path (read from there the first time), or that doesn't
+    save them, for None."""
+    if path not in duration_caches:
+        duration_caches[path] = DurationCache(path)
+    return duration_caches[path]
+
+
+def durationSeconds(durations):
+    """The number of seconds of each of a Series of durations, as float32
+    (NaN where there isn't a number and unit). See parseDurationStrings."""
+    return duration_cache.parse(durations)['seconds'].rename(durations.name)
+
+
+###########################################
+# End of ufo_durations.py
+###########################################
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: ufo_eras.py
+# Author: Ra Inta
+# Description: Splitting the UFO reports into eras, e.g. before and after the
+# smartphone (2007), to compare how often UFOs were reported in each. The
+# cutoffs can be years or dates, and there can be any number of them, so
+# other technology-adoption dates can be tried out in one line, e.g.:
+# annualRates(ufo_df['year'], [1995, 2007], ['pre-web', 'web', 'smartphone'])
+#
+###########################################
+
+import numbers
+
+import numpy as np
+import pandas as pd
+
+
+def eraTimes(values):
+    """Years (integers) or datetimes, as datetime64[s]; a year becomes the
+    start of that year."""
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values):
+        missing = values.isna().to_numpy()
+        years = values.fillna(1970).to_numpy(dtype=np.int64) - 1970
+        times = years.astype('datetime64[Y]').astype('datetime64[s]')
+        times[missing] = np.datetime64('NaT')
+        return times
+    return values.to_numpy(dtype='datetime64[s]')
+
+
+def cutoffTime(cutoff):
+    """A cutoff year (e.g. 2007) or date (e.g. '2007-06-29'), as datetime64[s]."""
+    if isinstance(cutoff, numbers.Integral):
+        return np.datetime64(str(cutoff), 's')
+    return np.datetime64(cutoff, 's')
+
+
+def eraLabels(cutoffs):
+    """The default era names, e.g. ['before 2007', '2007 on'] for [2007]."""
+    names = [str(cutoff) if isinstance(cutoff, numbers.Integral)
+             else np.datetime_as_string(cutoffTime(cutoff), unit='D') for cutoff in cutoffs]
+    labels = ['before ' + names[0]]
+    labels += [first + ' to ' + last for first, last in zip(names[:-1], names[1:])]
+    labels.append(names[-1] + ' on')
+    return labels
+
+
+def bucketEras(values, cutoffs, labels=None):
+    """Which era each of values (years or datetimes) falls in, as an ordered
+    categorical. There is one more era than cutoffs: the first is before the
+    first cutoff, and each cutoff starts the next (so 2007 itself is in the
+    era starting with 2007). Missing values have no era.
+    labels: names of the eras (default: see eraLabels)."""
+    cutoff_times = np.array([cutoffTime(cutoff) for cutoff in cutoffs], dtype='datetime64[s]')
+    if (np.diff(cutoff_times) <= np.timedelta64(0, 's')).any():
+        raise ValueError("Era cutoffs must be in increasing order")
+    if labels is None:
+        labels = eraLabels(cutoffs)
+    if len(labels) != len(cutoffs) + 1:
+        raise ValueError("There must be one more era label than cutoffs")
+    times = eraTimes(values)
+    codes = np.searchsorted(cutoff_times, times, side='right')
+    codes[np.isnat(times)] = -1
+    eras = pd.Categorical.from_codes(codes, categories=labels, ordered=True)
+    if isinstance(values, pd.Series):
+        return pd.Series(eras, index=values.index, name='era')
+    return eras
+
+
+def annualRates(values, cutoffs, labels=None, counts=None):
+    """The average number of reports per year in each era, i.e. the number of
+    reports in the era over the number of (calendar) years it has reports in.
+    values: the year or datetime of each report. Or, with counts, distinct
+    years (or datetimes) and the number of reports in each, e.g. from a cube:
+    year_counts = cube.counts('year')
+    annualRates(year_counts.index, [2007], counts=year_counts.values)
+    cutoffs, labels: as for bucketEras.
+    Returns a DataFrame indexed by era, of the reports, years, first and last
+    year, and reports_per_year."""
+    times = eraTimes(values)
+    if counts is None:
+        counts = np.ones(len(times), dtype=np.int64)
+    by_era = pd.DataFrame({
+        'era': bucketEras(times.astype('datetime64[s]'), cutoffs, labels),
+        'year': times.astype('datetime64[Y]').astype(np.int64) + 1970,
+        'reports': np.asarray(counts, dtype=np.int64),
+    })
+    by_era = by_era[by_era['reports'] > 0].groupby('era', observed=False)
+    rates = pd.DataFrame({
+        'reports': by_era['reports'].sum(),
+        'years': by_era['year'].nunique(),
+        'first_year': by_era['year'].min(),
+        'last_year': by_era['year'].max(),
+    })
+    rates['reports_per_year'] = rates['reports']/rates['years']
+    return rates
+
+
+###########################################
+# End of ufo_eras.py
+###########################################
@@ -0,0 +1,245 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: ufo_gazetteer.py
+# Author: Ra Inta
+# Description: A gazetteer of the ~770 most populous US cities, for the
+# reports per capita. It is built from the US census population estimates
+# (PEP_2017_PEPANNRSIP.US12A_with_ann.csv) and the state abbreviations
+# (state_abbrev.txt), just as in ufo_analysis.py, but only once: the result is
+# saved (census_gazetteer.pkl), and rebuilt only if either input changes.
+# Each city gets an integer id (its row), so the reports can be matched to
+# their city with a single hash lookup, and each report to the population of
+# its city in the year of the report (2010-2017).
+# Report cities that are spelled differently to the census (e.g. 'St. Louis',
+# 'Pheonix') can be matched approximately, too, with matchCities.
+#
+###########################################
+
+import difflib
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+census_filename = "PEP_2017_PEPANNRSIP.US12A_with_ann.csv"
+states_filename = "state_abbrev.txt"
+gazetteer_filename = "census_gazetteer.pkl"
+
+# The years of the population estimates (the respop7YYYY columns)
+population_years = list(range(2010, 2018))
+
+# The few cities with hyphens or official county designations or other
+# weirdnesses, keyed by their census (FIPS) place code:
+census_names = {
+    4752006: "Nashville city, Tennessee",
+    2146027: "Lexington city, Kentucky",
+    3775000: "Winston city, North Carolina",
+    1304204: "Augusta city, Georgia",
+    1349008: "Macon County, Georgia",
+    1303440: "Athens County, Georgia",
+    2148006: "Louisville city, Kentucky",
+    1571550: "Honolulu city, Hawaii",
+}
+
+# 'X city, Y', where X is the city and Y the state. But there are also towns,
+# villages and counties in the mix:
+city_state_regex = r'^(.*?)(?: [Cc]ity| town| [Cc]ounty| village| municipality), (.*)$'
+
+
+def buildGazetteer(census=census_filename, states=states_filename):
+    """DataFrame of the census cities, indexed by city id, with their
+    'rank' (by 2017 population), 'city', 'state' (name), 'abbreviation',
+    'city_abbrev' (e.g. 'Chicago, IL', the same form as the cleaned report
+    cities) and populations 'pop_2010' to 'pop_2017'."""
+    population_columns = ['respop7{0}'.format(year) for year in population_years]
+    census_df = pd.read_csv(census, encoding='latin-1', dtype={'GC_RANK.target-geo-id2': np.int64},
+                            usecols=['GC_RANK.target-geo-id2', 'GC_RANK.rank-label', 'GC_RANK.display-label.1']
+                            + population_columns)
+    city_state = census_df['GC_RANK.display-label.1'].str.replace(' (balance)', '', regex=False)
+    city_state = census_df['GC_RANK.target-geo-id2'].map(census_names).fillna(city_state)
+    parts = city_state.str.extract(city_state_regex)
+    abbreviations = pd.read_csv(states).set_index('state')['abbreviation']
+    gazetteer = pd.DataFrame({
+        'rank': census_df['GC_RANK.rank-label'].astype(np.int16),
+        'city': parts[0].fillna(city_state),
+        'state': parts[1].fillna(city_state),
+    })
+    gazetteer['abbreviation'] = gazetteer['state'].map(abbreviations)
+    gazetteer['city_abbrev'] = gazetteer['city'] + ', ' + gazetteer['abbreviation']
+    for year, column in zip(population_years, population_columns):
+        gazetteer['pop_{0}'.format(year)] = census_df[column].astype(np.int32)
+    # A city listed twice (there aren't any) would be matched to the bigger one
+    gazetteer = gazetteer.sort_values('rank', kind='stable').drop_duplicates('city_abbrev')
+    gazetteer = gazetteer.reset_index(drop=True)
+    gazetteer.index.name = 'city_id'
+    return gazetteer
+
+
+def loadGazetteer(path=gazetteer_filename, census=census_filename, states=states_filename):
+    """The gazetteer (see buildGazetteer), from path if it is newer than
+    both inputs, otherwise built and saved there."""
+    if os.path.exists(path) and os.path.getmtime(path) >= max(os.path.getmtime(census),
+                                                               os.path.getmtime(states)):
+        return pd.read_pickle(path)
+    gazetteer = buildGazetteer(census, states)
+    # Write to a temporary file first, so a crash can't leave a
+    # half-written gazetteer behind
+    tmp_path = path + '.tmp'
+    gazetteer.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+    return gazetteer
+
+
+def cityIds(gazetteer, cities):
+    """The gazetteer city id of each of a Series of 'City, ST' names (as in
+    ufo_analysis.py, once the state has been added to the city), or -1 if it
+    isn't one of the census cities. Each distinct name is only looked up
+    once."""
+    codes, uniques = pd.factorize(cities)
+    ids = pd.Index(gazetteer['city_abbrev']).get_indexer(uniques)
+    return pd.Series(np.append(ids, -1)[codes].astype(np.int32), index=cities.index, name='city_id')
+
+
+def populations(gazetteer, city_ids, years):
+    """The population of each city id in each year. Years before 2010 or
+    after 2017 take the nearest estimate; city ids of -1 are NaN."""
+    city_ids = np.asarray(city_ids)
+    table = gazetteer[['pop_{0}'.format(year) for year in population_years]].to_numpy(dtype=np.float64)
+    table = np.vstack([table, np.full(len(population_years), np.nan)])  # for city id -1
+    year_index = np.clip(np.asarray(years, dtype=np.int64), population_years[0], population_years[-1]) \
+        - population_years[0]
+    return table[city_ids, year_index]
+
+
+def perCapitaRates(ufo_df, gazetteer, city_ids=None):
+    """The reports per 1,000 residents of each census city, where each report
+    counts against the population of its city in the year of the report.
+    ufo_df needs 'city' (as 'City, ST') and 'year'.
+    city_ids: the census city of each report, e.g. from CityMatcher.match
+    (default: only exact matches, see cityIds).
+    Returns a DataFrame indexed by 'City, ST' of the number of reports, the
+    2017 population and obs_per_1000, most reports per capita first."""
+    if city_ids is None:
+        city_ids = cityIds(gazetteer, ufo_df['city'])
+    city_ids = pd.Series(city_ids)
+    matched = city_ids.to_numpy() >= 0
+    city_ids = city_ids.to_numpy()[matched]
+    per_1000 = 1000/populations(gazetteer, city_ids, ufo_df['year'].to_numpy()[matched])
+    rates = pd.DataFrame({
+        'posted': np.bincount(city_ids, minlength=len(gazetteer)),
+        'pop': gazetteer['pop_2017'].to_numpy(),
+        'obs_per_1000': np.bincount(city_ids, weights=per_1000, minlength=len(gazetteer)),
+    }, index=pd.Index(gazetteer['city_abbrev'], name='city'))
+    rates = rates[rates['posted'] > 0]
+    return rates.sort_values('obs_per_1000', ascending=False)
+
+
+# Abbreviations spelled out, and words dropped, before comparing city names
+name_words = {'st': 'saint', 'ste': 'sainte', 'mt': 'mount', 'ft': 'fort', 'pt': 'port'}
+dropped_words = {'city', 'town', 'township', 'twp', 'village', 'county', 'area', 'downtown'}
+
+
+def cityKey(name):
+    """A city name lower-cased, without punctuation, with abbreviations spelled
+    out and words like 'city' dropped, e.g. 'St. Louis City' gives
+    'saint louis'."""
+    words = re.sub(r"[^a-z0-9 ]", " ", name.lower()).split()
+    return ' '.join(name_words.get(word, word) for word in words if word not in dropped_words)
+
+
+soundex_codes = dict((letter, str(code)) for code, letters in enumerate(
+    ['aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r']) for letter in letters)
+
+
+def soundex(key):
+    """The Soundex code of a city key, e.g. 'phoenix' and 'pheonix' both give
+    'P520', for blocking together names that sound alike."""
+    letters = [letter for letter in key if letter in soundex_codes]
+    if not letters:
+        return ''
+    code, previous = letters[0].upper(), soundex_codes[letters[0]]
+    for letter in letters[1:]:
+        digit = soundex_codes[letter]
+        if digit != previous and digit != '0':
+            code += digit
+        if letter not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+class CityMatcher(object):
+    """Match report cities ('City, ST') to the census cities of a gazetteer,
+    exactly if possible, then by their keys (see cityKey), then approximately.
+    Only census cities in the same state, and sharing the first three letters
+    or the Soundex code of the key, are compared (blocking), so there are
+    only a handful of comparisons per name, never the full cross product.
+    Names are compared with difflib's similarity ratio (1 is identical), and
+    the best match of at least min_score is taken."""
+
+    def __init__(self, gazetteer, min_score=0.85):
+        self.gazetteer = gazetteer
+        self.min_score = min_score
+        self.exact = pd.Index(gazetteer['city_abbrev'])
+        keys = gazetteer['city'].map(cityKey)
+        self.keys = pd.Index(keys + ', ' + gazetteer['abbreviation'])
+        self.city_keys = keys.tolist()
+        self.blocks = {}
+        for city_id, (key, state) in enumerate(zip(keys, gazetteer['abbreviation'])):
+            for block in [(state, key[:3]), (state, soundex(key))]:
+                self.blocks.setdefault(block, set()).add(city_id)
+
+    def fuzzyMatch(self, key, state):
+        """(city id, score) of the best census city for a city key in a
+        state, or (-1, best score) if none are close enough."""
+        best_id, best_score = -1, 0.0
+        candidates = self.blocks.get((state, key[:3]), set()) | self.blocks.get((state, soundex(key)), set())
+        for city_id in candidates:
+            matcher = difflib.SequenceMatcher(None, key, self.city_keys[city_id])
+            if matcher.real_quick_ratio() < self.min_score or matcher.quick_ratio() < self.min_score:
+                continue
+            score = matcher.ratio()
+            if score > best_score:
+                best_id, best_score = city_id, score
+        if best_score < self.min_score:
+            return -1, best_score
+        return best_id, best_score
+
+    def match(self, cities):
+        """DataFrame, with the index of the Series cities ('City, ST'), of
+        the census 'city_id' (-1 if none), how it was matched ('exact', 'key',
+        'fuzzy' or missing) and its similarity 'score'. Each distinct city is
+        only matched once."""
+        codes, uniques = pd.factorize(cities)
+        uniques = pd.Series(uniques, dtype=object)
+        ids = self.exact.get_indexer(uniques)
+        how = np.where(ids >= 0, 'exact', None).astype(object)
+        scores = np.where(ids >= 0, 1.0, np.nan)
+        parts = uniques.str.rsplit(', ', n=1, expand=True).reindex(columns=[0, 1])
+        keys = parts[0].map(cityKey, na_action='ignore')
+        unmatched = np.flatnonzero(ids < 0)
+        key_ids = self.keys.get_indexer(keys[unmatched] + ', ' + parts[1][unmatched])
+        keys, states = keys.tolist(), parts[1].tolist()
+        for i, city_id in zip(unmatched, key_ids):
+            if city_id >= 0:
+                ids[i], how[i], scores[i] = city_id, 'key', 1.0
+            elif isinstance(keys[i], str) and isinstance(states[i], str):
+                city_id, score = self.fuzzyMatch(keys[i], states[i])
+                if city_id >= 0:
+                    ids[i], how[i], scores[i] = city_id, 'fuzzy', score
+        # Missing cities (code -1) pick up the values on the end
+        return pd.DataFrame({'city_id': np.append(ids, -1)[codes].astype(np.int32),
+                             'how': np.append(how, None)[codes],
+                             'score': np.append(scores, np.nan)[codes]}, index=cities.index)
+
+
+def matchRates(matched):
+    """The fraction of reports matched each way, from CityMatcher.match."""
+    return matched['how'].fillna('unmatched').value_counts(normalize=True)
+
+
+###########################################
+# End of ufo_gazetteer.py
+###########################################
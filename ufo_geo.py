@@ -0,0 +1,183 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: ufo_geo.py
+# Author: Ra Inta
+# Description: Putting the UFO reports on the map. Each report's city and
+# state are looked up (offline) in the US census Gazetteer of places, which
+# has the latitude and longitude of every US city, town, village and CDP,
+# e.g. the 2017 edition:
+# https://www2.census.gov/geo/docs/maps-data/data/gazetteer/2017_Gazetteer/2017_Gaz_place_national.zip
+# (unzip it next to the data). Then a grid index over the reports' locations
+# answers questions like 'all of the reports within 50 km of Roswell, NM
+# between 1947 and 1950' by only looking at the reports in the few grid cells
+# nearby, e.g.:
+#
+# places = loadPlaces()
+# locations = geocode(ufo_df['city'], ufo_df['state'], places)
+# index = ReportIndex(locations['lat'], locations['lon'], ufo_df['year'])
+# lat, lon = placeLocation(places, 'Roswell', 'NM')
+# ufo_df.iloc[index.within(lat, lon, 50, years=(1947, 1950))]
+#
+###########################################
+
+import numpy as np
+import pandas as pd
+
+from ufo_gazetteer import cityKey
+
+places_filename = "2017_Gaz_place_national.txt"
+
+earth_radius_km = 6371.0
+
+# The census adds the kind of place to its name, in lower case (or 'CDP'),
+# e.g. 'Roswell city', 'Tinley Park village', 'Nashville-Davidson
+# metropolitan government (balance)':
+place_type_regex = r'(?: (?:[a-z]+|CDP))+(?: \(balance\))?$'
+
+
+def loadPlaces(path=places_filename):
+    """DataFrame of the places in a census Gazetteer places file, indexed by
+    their 'key, ST' (see cityKey), with their 'name', 'state' (abbreviation),
+    'lat' and 'lon'. Where two places share a key (usually a city and a CDP
+    of the same name), the one with the most land is kept."""
+    places = pd.read_csv(path, sep='\t', dtype={'GEOID': str}, encoding='latin-1')
+    places.columns = places.columns.str.strip()  # the last column name has trailing spaces
+    names = places['NAME'].str.replace(place_type_regex, '', regex=True)
+    places = pd.DataFrame({
+        'key': names.map(cityKey) + ', ' + places['USPS'],
+        'name': names,
+        'state': places['USPS'],
+        'lat': places['INTPTLAT'].astype(np.float64),
+        'lon': places['INTPTLONG'].astype(np.float64),
+        'land': places['ALAND'],
+    })
+    places = places.sort_values('land', ascending=False, kind='stable').drop_duplicates('key')
+    return places.set_index('key').drop(columns='land')
+
+
+def placeLocation(places, city, state):
+    """(latitude, longitude) of a city in a state (abbreviation)."""
+    place = places.loc[cityKey(city) + ', ' + state]
+    return place['lat'], place['lon']
+
+
+def geocode(cities, states, places):
+    """DataFrame, with the index of cities, of the latitude ('lat') and
+    longitude ('lon') of each report's city and state (NaN if it isn't in
+    places). Each distinct city and state is only looked up once."""
+    keys = cities.astype(object) + ', ' + states.astype(object)
+    codes, uniques = pd.factorize(keys)
+    uniques = pd.Series(uniques, dtype=object)
+    parts = uniques.str.rsplit(', ', n=1, expand=True).reindex(columns=[0, 1])
+    ids = places.index.get_indexer(parts[0].map(cityKey) + ', ' + parts[1])
+    # Unknown places (-1) and missing cities (code -1) pick up the NaNs on the end
+    lat = np.append(places['lat'].to_numpy(), np.nan)
+    lon = np.append(places['lon'].to_numpy(), np.nan)
+    rows = np.append(np.where(ids >= 0, ids, len(places)), len(places))[codes]
+    return pd.DataFrame({'lat': lat[rows], 'lon': lon[rows]}, index=cities.index)
+
+
+def distancesKm(lat, lon, lats, lons):
+    """Great circle (haversine) distances from (lat, lon) to (lats, lons)."""
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = np.sin((lats - lat)/2)**2 + np.cos(lat)*np.cos(lats)*np.sin((lons - lon)/2)**2
+    return 2*earth_radius_km*np.arcsin(np.sqrt(a))
+
+
+def wrapLongitudes(lons):
+    """Longitudes wrapped into [-180, 180), e.g. 190 is -170."""
+    return (np.asarray(lons, dtype=np.float64) + 180) % 360 - 180
+
+
+class ReportIndex(object):
+    """A grid index over the locations of the reports: the reports are
+    sorted by the grid cell (cell_degrees of latitude by longitude) they are
+    in, so the reports in a row of cells are one contiguous slice. A query
+    only checks the reports in the cells overlapping its bounding box.
+    A box can cross the antimeridian (±180°, e.g. around the Aleutians): it
+    runs east from west, so west=170, east=-170 (or 190) is 20 degrees wide.
+    Queries return the positions (for .iloc) of the matching reports, in
+    order. Reports without a location are never returned."""
+
+    def __init__(self, lats, lons, years, cell_degrees=0.5):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.years = np.asarray(years, dtype=np.int64)
+        self.cell_degrees = cell_degrees
+        self.n_columns = int(np.ceil(360/cell_degrees))
+        located = np.flatnonzero(~np.isnan(self.lats) & ~np.isnan(self.lons))
+        cells = self.cellIds(self.lats[located], self.lons[located])
+        order = np.argsort(cells, kind='stable')
+        self.positions = located[order]
+        self.cells = cells[order]
+
+    def cellRow(self, lats):
+        return np.floor((np.asarray(lats) + 90)/self.cell_degrees).astype(np.int64)
+
+    def cellColumn(self, lons):
+        return np.floor((wrapLongitudes(lons) + 180)/self.cell_degrees).astype(np.int64) % self.n_columns
+
+    def cellIds(self, lats, lons):
+        return self.cellRow(lats)*self.n_columns + self.cellColumn(lons)
+
+    def columnRanges(self, west, east):
+        """(first, last) columns of cells from west to east: two ranges if
+        they cross the antimeridian, and every column if 360 degrees or more."""
+        if east - west >= 360:
+            return [(0, self.n_columns - 1)]
+        first_column, last_column = self.cellColumn(west), self.cellColumn(east)
+        if wrapLongitudes(west) <= wrapLongitudes(east):
+            return [(first_column, last_column)]
+        return [(first_column, self.n_columns - 1), (0, last_column)]
+
+    def candidates(self, south, west, north, east):
+        """Positions of the reports in the cells overlapping a bounding box."""
+        column_ranges = self.columnRanges(west, east)
+        slices = []
+        for row in range(self.cellRow(south), self.cellRow(north) + 1):
+            for first_column, last_column in column_ranges:
+                start, stop = np.searchsorted(self.cells, [row*self.n_columns + first_column,
+                                                           row*self.n_columns + last_column + 1])
+                slices.append(self.positions[start:stop])
+        return np.concatenate(slices) if slices else np.array([], dtype=np.int64)
+
+    def inLongitudes(self, lons, west, east):
+        """Whether each of lons is from west to east (see columnRanges)."""
+        if east - west >= 360:
+            return np.ones(len(lons), dtype=bool)
+        lons, west, east = wrapLongitudes(lons), wrapLongitudes(west), wrapLongitudes(east)
+        if west <= east:
+            return (lons >= west) & (lons <= east)
+        return (lons >= west) | (lons <= east)
+
+    def filterYears(self, positions, years):
+        if years is not None:
+            first, last = years
+            positions = positions[(self.years[positions] >= first) & (self.years[positions] <= last)]
+        return positions
+
+    def inBox(self, south, west, north, east, years=None):
+        """Positions of the reports in a bounding box (degrees), and in years
+        ((first, last), inclusive) if given."""
+        positions = self.candidates(south, west, north, east)
+        lats, lons = self.lats[positions], self.lons[positions]
+        positions = positions[(lats >= south) & (lats <= north) & self.inLongitudes(lons, west, east)]
+        return np.sort(self.filterYears(positions, years))
+
+    def within(self, lat, lon, radius_km, years=None):
+        """Positions of the reports within radius_km of (lat, lon), and in
+        years ((first, last), inclusive) if given."""
+        lat_degrees = np.degrees(radius_km/earth_radius_km)
+        # A degree of longitude shrinks away from the equator
+        lon_degrees = lat_degrees/max(np.cos(np.radians(min(abs(lat) + lat_degrees, 89.9))), 1e-6)
+        positions = self.candidates(lat - lat_degrees, lon - lon_degrees, lat + lat_degrees, lon + lon_degrees)
+        positions = self.filterYears(positions, years)
+        distances = distancesKm(lat, lon, self.lats[positions], self.lons[positions])
+        return np.sort(positions[distances <= radius_km])
+
+
+###########################################
+# End of ufo_geo.py
+###########################################
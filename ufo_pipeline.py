@@ -0,0 +1,185 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: ufo_pipeline.py
+# Author: Ra Inta
+# Description: The steps of ufo_analysis.py as callable stages (load, clean
+# the cities, join the census populations, aggregate and plot), without the
+# exploration in between, so the whole analysis can be re-run on new or
+# extended data in one go:
+#
+# ufo_df, results = runAnalysis(processes=32)
+#
+# The cleaning and matching work row by row, so with processes > 1 they are
+# done on chunks of rows in a pool of processes. The chunks are put back
+# together in their original order, so the results are the same, byte for
+# byte, as doing it all in one process (check with python ufo_pipeline.py).
+#
+###########################################
+
+import multiprocessing
+import os
+
+import pandas as pd
+
+from ufo_cities import normalizeCities, purgeCityModifiers
+from ufo_data import csv_filename, details_filename, loadReports, readReportDetails
+from ufo_durations import durationSeconds
+from ufo_eras import annualRates
+from ufo_gazetteer import CityMatcher, loadGazetteer, perCapitaRates, populations
+
+# The plots are optional: they need matplotlib
+try:
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+# The three reports with mis-entered years (see ufo_analysis.py)
+bad_years = [1617, 1615, 1721]
+
+# The big cities whose variants ('North Las Vegas', 'Seattle Area') are
+# folded into the city itself (see purgeCityModifiers)
+cities_to_clean = ["Sacramento", "Seattle", "Milwaukee", "Baltimore",
+                   "Las Vegas", "Boston", "San Francisco", "Washington",
+                   "Chicago", "Los Angeles", "New York"]
+
+# Rows per chunk, when cleaning in parallel
+chunk_rows = 50000
+
+
+def loadStage(path=csv_filename, details=None):
+    """The reports (see loadReports), without the mis-entered years. With
+    details (the path of the report details CSV, see readReportDetails), the
+    'description' of each report is joined on too."""
+    ufo_df = loadReports(path)
+    ufo_df = ufo_df[~ufo_df['year'].isin(bad_years)]
+    if details is not None:
+        descriptions = readReportDetails(details, columns=['url', 'description'])
+        descriptions = descriptions.drop_duplicates('url', keep='last').set_index('url')['description']
+        ufo_df = ufo_df.assign(description=ufo_df['url'].map(descriptions))
+    return ufo_df
+
+
+def cleanStage(ufo_df):
+    """The reports with a city, the city names cleaned (see normalizeCities
+    and purgeCityModifiers) and followed by the state ('City, ST'), and the
+    durations in seconds ('duration_seconds'). Works on each row on its own,
+    so can be run on chunks of rows."""
+    ufo_df = ufo_df.dropna(subset=['city'])
+    cities, n_purged = purgeCityModifiers(normalizeCities(ufo_df['city']), cities_to_clean)
+    return ufo_df.assign(city=cities + ', ' + ufo_df['state'].astype(object),
+                         duration_seconds=durationSeconds(ufo_df['duration']))
+
+
+def joinStage(ufo_df, gazetteer):
+    """The reports with the census city each is matched to ('city_id', -1
+    if none, see CityMatcher) and its population in the year of the report.
+    Works on each row on its own, so can be run on chunks of rows."""
+    matched = CityMatcher(gazetteer).match(ufo_df['city'])
+    return ufo_df.assign(city_id=matched['city_id'], match=matched['how'],
+                         pop=populations(gazetteer, matched['city_id'], ufo_df['year']))
+
+
+def aggregateStage(ufo_df, gazetteer):
+    """The counts and rates behind the plots of ufo_analysis.py, as a dict
+    of Series and DataFrames."""
+    return {
+        'by_month': ufo_df.groupby('month')['posted'].count(),
+        'by_year': ufo_df.groupby('year')['posted'].count(),
+        'by_shape': ufo_df.groupby('shape')['posted'].count().sort_values(ascending=False, kind='stable'),
+        'by_state': ufo_df.groupby('state')['posted'].count().sort_values(ascending=False, kind='stable'),
+        'by_city': ufo_df.groupby('city')['posted'].count().sort_values(ascending=False, kind='stable'),
+        'smartphone_rates': annualRates(ufo_df['year'], [2007], ['pre-smartphone', 'post-smartphone']),
+        'per_capita': perCapitaRates(ufo_df, gazetteer, city_ids=ufo_df['city_id']),
+    }
+
+
+def plotStage(results, directory='.'):
+    """Save the plots of ufo_analysis.py, from aggregateStage, in directory."""
+    if plt is None:
+        raise ImportError("Plotting requires matplotlib")
+    plots = [
+        (results['by_month'], 'bar', "Month of report", "Number of reports",
+         "Distribution of UFO reports by month", "UFO_observations_by_month.png"),
+        (results['by_year'][results['by_year'].index > 1920], 'line', "Year of report", "Number of reports",
+         "Increase in UFO reports over time", "UFO_observations_over_years.png"),
+        (results['by_shape'].head(20), 'bar', "UFO shape", "Number of observations",
+         "Reported UFO shape", "UFO_reports_by_UFO_shape.png"),
+        (results['by_city'].head(10), 'barh', "Number of reports", "US city",
+         "UFO reports by city", "UFO_observations_by_city.png"),
+        (results['per_capita']['obs_per_1000'].head(10), 'barh', "Reports per 1,000 residents", "City",
+         "Cities with highest UFO reports per capita", "City_reports_per_capita.png"),
+    ]
+    for counts, kind, xlabel, ylabel, title, filename in plots:
+        plt.figure()
+        counts.plot(kind=kind)
+        if kind == 'barh':
+            plt.gca().invert_yaxis()
+        plt.xlabel(xlabel)
+        plt.ylabel(ylabel)
+        plt.title(title, fontname="Covert Ops", fontsize=16)
+        plt.savefig(os.path.join(directory, filename))
+        plt.close()
+
+
+def runStages(ufo_df, stages):
+    """Each of stages, (stage, args), in turn: ufo_df = stage(ufo_df, *args)."""
+    for stage, args in stages:
+        ufo_df = stage(ufo_df, *args)
+    return ufo_df
+
+
+def runChunks(ufo_df, stages, processes=1, rows=chunk_rows):
+    """Run stages (see runStages) on ufo_df, or, with more than one process,
+    on each chunk of rows in a pool of processes, put back together in the
+    order of the chunks. The stages must work on each row on its own."""
+    if processes <= 1 or len(ufo_df) <= rows:
+        return runStages(ufo_df, stages)
+    chunks = [ufo_df.iloc[start:start + rows] for start in range(0, len(ufo_df), rows)]
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        cleaned = pool.starmap(runStages, [(chunk, stages) for chunk in chunks])
+    return pd.concat(cleaned)
+
+
+def runAnalysis(path=csv_filename, details=None, processes=1, rows=chunk_rows, plots=False, directory='.'):
+    """Run the stages of the analysis on the reports in path (and the report
+    details, if given), cleaning and matching them in chunks of rows over
+    processes. Returns the cleaned reports and the results of aggregateStage;
+    with plots, saves the plots in directory too."""
+    gazetteer = loadGazetteer()
+    ufo_df = loadStage(path, details)
+    ufo_df = runChunks(ufo_df, [(cleanStage, ()), (joinStage, (gazetteer,))], processes, rows)
+    results = aggregateStage(ufo_df, gazetteer)
+    if plots:
+        plotStage(results, directory)
+    return ufo_df, results
+
+
+def resultBytes(ufo_df, results):
+    """The cleaned reports and results, as CSV, to compare runs by."""
+    return b''.join([ufo_df.to_csv().encode()] + [results[name].to_csv().encode() for name in sorted(results)])
+
+
+if __name__ == "__main__":
+    # Check the results are the same in parallel, and time both
+    import sys
+    import time
+    path = sys.argv[1] if len(sys.argv) > 1 else csv_filename
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    details = details_filename if os.path.exists(details_filename) else None
+    start = time.time()
+    serial = runAnalysis(path, details)
+    serial_time = time.time() - start
+    start = time.time()
+    parallel = runAnalysis(path, details, processes=processes, rows=max(1000, len(serial[0])//(4*processes)))
+    parallel_time = time.time() - start
+    if resultBytes(*serial) != resultBytes(*parallel) or not serial[0].equals(parallel[0]):
+        sys.exit("The results in parallel differ from those in serial!")
+    print("Same results in serial and over {0} processes, for {1} reports".format(processes, len(serial[0])))
+    print("Serial {0:.3f} s, {1} processes {2:.3f} s".format(serial_time, processes, parallel_time))
+
+
+###########################################
+# End of ufo_pipeline.py
+###########################################
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+#
+###########################################
+#
+# File: ufo_query.py
+# Author: Ra Inta
+# Description: Quick look-ups of the reports from a city, and from a range of
+# times, as in the tail of ufo_analysis.py (Phoenix, Roswell, Chicago...).
+# Rather than checking every report against the city and then the dates,
+# the reports are kept sorted by city and event time, with the offset of the
+# first report of each city. A query is then a hash lookup of the city and
+# two binary searches, and returns a slice of the sorted table (a view, not
+# a copy). Looking up a range of times over all cities goes through the
+# order of the table by time (just the positions, not another copy of the
+# reports), e.g.:
+#
+# reports = ReportTable(ufo_df)
+# reports.city('Phoenix, AZ', start=dt.datetime(1966, 1, 1))
+# reports.city('Roswell, NM', start=1947, end=1951)
+# reports.between('1997-03-13', '1997-03-14')
+#
+###########################################
+
+import numpy as np
+import pandas as pd
+
+from ufo_eras import cutoffTime
+
+
+class ReportTable(object):
+    """The reports (ufo_df) sorted by city, then event time, for looking up
+    the reports from a city, or a range of times, by binary search.
+    Times can be given as years (e.g. 1947, meaning the start of 1947) or
+    anything numpy takes as a date. start is inclusive and end exclusive.
+    Reports without an event time come first within their city, and are only
+    included if there is no start."""
+
+    def __init__(self, ufo_df, city_column='city', time_column='event_time'):
+        self.time_column = time_column
+        codes, cities = pd.factorize(ufo_df[city_column])
+        self.cities = pd.Index(cities)
+        times = ufo_df[time_column].to_numpy()
+        self.time_unit = np.datetime_data(times.dtype)[0]
+        # (Reports without a city, code -1, sort first and can't be asked for)
+        order = np.lexsort((times.view(np.int64), codes))
+        self.table = ufo_df.take(order)
+        # Searched as integers, in which NaT is the smallest, as they were sorted
+        self.times = times.view(np.int64)[order]
+        # Reports of city id i are self.table.iloc[offsets[i]:offsets[i + 1]]
+        self.offsets = np.searchsorted(codes[order], np.arange(len(cities) + 1))
+        # Positions in self.table in order of event time (reports at the same
+        # time in their order in ufo_df, as for a stable sort of ufo_df)
+        self.by_time = np.lexsort((order, self.times))
+        self.sorted_times = self.times[self.by_time]
+
+    def toTime(self, when):
+        return cutoffTime(when).astype('datetime64[{0}]'.format(self.time_unit)).view(np.int64)
+
+    def timeSlice(self, times, first, last, start, end):
+        """First and last (exclusive) positions of the times from start to end
+        in times[first:last], which are sorted."""
+        if start is not None:
+            first += np.searchsorted(times[first:last], self.toTime(start), side='left')
+        if end is not None:
+            last = first + np.searchsorted(times[first:last], self.toTime(end), side='left')
+        return first, last
+
+    def city(self, city, start=None, end=None):
+        """The reports from city (as in ufo_df, e.g. 'Roswell, NM') from start
+        to end, in order of event time. Empty if there aren't any."""
+        try:
+            city_id = self.cities.get_loc(city)
+        except KeyError:
+            return self.table.iloc[0:0]
+        first, last = self.timeSlice(self.times, self.offsets[city_id], self.offsets[city_id + 1], start, end)
+        return self.table.iloc[first:last]
+
+    def between(self, start=None, end=None):
+        """All of the reports from start to end, in order of event time (a
+        copy, as they are spread across the cities of the table)."""
+        first, last = self.timeSlice(self.sorted_times, 0, len(self.sorted_times), start, end)
+        return self.table.take(self.by_time[first:last])
+
+
+###########################################
+# End of ufo_query.py
+###########################################